@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Optional
+
+from metrics import LIST_CACHE_EVENTS, READ_COALESCING_EVENTS
+
+logger = logging.getLogger(__name__)
+
+
+class ListCache:
+    """In-process LRU cache of list documents with TTL and version checks.
+
+    Cached documents are shared between callers and must be treated as read-only.
+    Invalidated entries are kept as tombstones so that a read which started before
+    a write cannot put its older document back into the cache. Tombstones remember the
+    last known version, so a document older than one already seen is never stored. When a tombstone is
+    evicted its generation is remembered, and reads that started before it are not cached.
+    ``on_invalidate`` is called with the list id on every invalidation, so that coalesced
+    reads of that list can be dropped.
+
+    The cache and its counters belong to one worker process; the same events are
+    exported as Prometheus counters so that they can be aggregated across workers.
+    """
+
+    def __init__(self, max_size: int, ttl: float, on_invalidate: Optional[Callable[[str], None]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_invalidate = on_invalidate
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.evicted_generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_rejections = 0
+        self.validation_misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def begin_read(self) -> int:
+        return self.generation
+
+    def get(self, list_id: str):
+        if not self.enabled:
+            return None
+        entry = self.entries.get(list_id)
+        if entry is None or entry[1] is None:
+            self._record("misses")
+            return None
+        stored_at, list_data, _, version = entry
+        if time.monotonic() - stored_at > self.ttl:
+            self.entries[list_id] = (stored_at, None, 0, version)
+            self._record("expirations")
+            self._record("misses")
+            return None
+        self.entries.move_to_end(list_id)
+        self._record("hits")
+        return list_data
+
+    def put(self, list_id: str, list_data: dict, read_generation: int = None):
+        if not self.enabled:
+            return
+        entry = self.entries.get(list_id)
+        if entry is None and read_generation is not None and read_generation < self.evicted_generation:
+            self._record("stale_rejections")
+            logger.debug(f"put: Rejected document read before an evicted invalidation for list_id={list_id}")
+            return
+        version = list_data.get("version", 0)
+        if entry is not None:
+            _, cached_data, invalidated_at, known_version = entry
+            if cached_data is None and read_generation is not None and invalidated_at > read_generation:
+                self._record("stale_rejections")
+                logger.debug(f"put: Rejected document read before invalidation for list_id={list_id}")
+                return
+            if known_version > version:
+                self._record("stale_rejections")
+                logger.debug(f"put: Rejected stale version {version} for list_id={list_id}")
+                return
+        self.entries[list_id] = (time.monotonic(), list_data, None, version)
+        self.entries.move_to_end(list_id)
+        self._evict()
+
+    def invalidate(self, list_id: str):
+        self.generation += 1
+        if self.on_invalidate is not None:
+            self.on_invalidate(list_id)
+        if not self.enabled:
+            return
+        entry = self.entries.get(list_id)
+        self.entries[list_id] = (time.monotonic(), None, self.generation, entry[3] if entry else 0)
+        self.entries.move_to_end(list_id)
+        self._evict()
+
+    def reject(self, list_id: str):
+        """Drops an entry whose version turned out to be older than the one in MongoDB."""
+        self._record("validation_misses")
+        self.invalidate(list_id)
+
+    def refresh(self, list_id: str, list_data: dict):
+        """Stores the result of a write unless a newer version is already cached.
+
+        Writes can finish out of order, so the older result only advances the generation.
+        """
+        entry = self.entries.get(list_id)
+        if entry is not None and entry[1] is not None and entry[3] > list_data.get("version", 0):
+            self.generation += 1
+            self._record("stale_rejections")
+            return
+        self.invalidate(list_id)
+        self.put(list_id, list_data)
+
+    def _evict(self):
+        while len(self.entries) > self.max_size:
+            _, (_, cached_data, invalidated_at, _) = self.entries.popitem(last=False)
+            if cached_data is None:
+                self.evicted_generation = max(self.evicted_generation, invalidated_at)
+            self._record("evictions")
+
+    def _record(self, event: str):
+        setattr(self, event, getattr(self, event) + 1)
+        LIST_CACHE_EVENTS.labels(event).inc()
+
+    def stats(self) -> dict:
+        return {"size": sum(1 for entry in self.entries.values() if entry[1] is not None),
+                "max_size": self.max_size, "ttl": self.ttl, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "expirations": self.expirations,
+                "stale_rejections": self.stale_rejections, "validation_misses": self.validation_misses}
+
+
+class SingleFlight:
+    """Coalesces concurrent identical reads into one in-flight query.
+
+    The first caller for a key starts the query; callers that arrive while it is running
+    await the same task and get the same result (or exception), which must be treated as
+    read-only. A caller that is cancelled does not cancel the query for the others.
+    Writers call forget() once they are done, so that reads arriving after a write never
+    join a query that started before it.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = {}
+        self.leaders = 0
+        self.collapsed = 0
+
+    async def do(self, key: Hashable, load: Callable[[], Awaitable]):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(load())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self._record("leaders")
+        else:
+            self._record("collapsed")
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable = None):
+        if key is None:
+            self.calls.clear()
+        else:
+            self.calls.pop(key, None)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # Marks the exception as retrieved when every caller has already gone away
+            task.exception()
+
+    def _record(self, event: str):
+        setattr(self, event, getattr(self, event) + 1)
+        READ_COALESCING_EVENTS.labels(self.name, event).inc()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self.calls), "leaders": self.leaders, "collapsed": self.collapsed}
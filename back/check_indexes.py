@@ -0,0 +1,43 @@
+import asyncio
+import logging
+import sys
+
+from database import Database
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()])
+logger = logging.getLogger(__name__)
+
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+
+async def check_indexes(create: bool = True) -> bool:
+    database = Database()
+    try:
+        if create:
+            await database.ensure_indexes()
+        ok = True
+        for name, collection, query in database.query_shapes():
+            explanation = await collection.find(query).explain()
+            stages = list(_plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {})))
+            if "COLLSCAN" in stages:
+                ok = False
+                logger.error(f"{name}: COLLSCAN on {collection.name} for {query} (stages: {stages})")
+            else:
+                logger.info(f"{name}: {collection.name} uses {stages}")
+        return ok
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(check_indexes(create="--no-create" not in sys.argv)) else 1)
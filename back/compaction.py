@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+from datetime import datetime, timedelta
+
+from config import (UTILS_COMPACTION_INTERVAL, UTILS_COMPACTION_BATCH_SIZE, UTILS_COMPACTION_MAX_DOCS_PER_SECOND,
+                    UTILS_COMPACTION_LEASE_SECONDS)
+from database import Database
+from metrics import UTILS_COMPACTION_BYTES, UTILS_COMPACTION_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+UTILS_COMPACTION_JOB = "utils_compaction"
+
+
+async def compact_utils(database: Database, owner: str) -> dict:
+    """Runs one full pass over the utils collection, throttled to UTILS_COMPACTION_MAX_DOCS_PER_SECOND."""
+    started = time.monotonic()
+    totals = {"scanned": 0, "updated": 0, "entries_removed": 0, "bytes_reclaimed": 0, "completed": False}
+    after_id = None
+    while True:
+        batch_started = time.monotonic()
+        batch = await database.compact_utils_batch(after_id, UTILS_COMPACTION_BATCH_SIZE)
+        if batch is None:
+            totals["completed"] = True
+            break
+        after_id = batch["last_id"]
+        for key in ("scanned", "updated", "entries_removed", "bytes_reclaimed"):
+            totals[key] += batch[key]
+        UTILS_COMPACTION_ENTRIES.inc(batch["entries_removed"])
+        UTILS_COMPACTION_BYTES.inc(batch["bytes_reclaimed"])
+        if not await database.renew_job_lease(UTILS_COMPACTION_JOB, owner, UTILS_COMPACTION_LEASE_SECONDS):
+            logger.warning("compact_utils: Lease lost, stopping the pass")
+            break
+        delay = batch["scanned"] / UTILS_COMPACTION_MAX_DOCS_PER_SECOND - (time.monotonic() - batch_started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+    totals["duration_s"] = round(time.monotonic() - started, 3)
+    logger.info(f"compact_utils: Scanned {totals['scanned']} utils documents, removed {totals['entries_removed']} "
+                f"entries from {totals['updated']} documents, reclaimed {totals['bytes_reclaimed']} bytes "
+                f"in {totals['duration_s']}s")
+    return totals
+
+
+async def run_utils_compaction(database: Database):
+    """Background loop started by the lifespan.
+
+    Every worker runs the loop, but a lease in the jobs collection lets only one of them
+    compact at a time; a finished pass keeps the lease until the next scheduled run.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    poll_interval = min(UTILS_COMPACTION_INTERVAL, 300)
+    await asyncio.sleep(random.uniform(0, poll_interval))
+    while True:
+        try:
+            started_at = datetime.utcnow()
+            if await database.acquire_job_lease(UTILS_COMPACTION_JOB, owner, UTILS_COMPACTION_LEASE_SECONDS):
+                result = await compact_utils(database, owner)
+                await database.finish_job(UTILS_COMPACTION_JOB, owner,
+                                          started_at + timedelta(seconds=UTILS_COMPACTION_INTERVAL), result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"run_utils_compaction: Compaction pass failed: {e}")
+        await asyncio.sleep(poll_interval)
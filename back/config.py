@@ -5,5 +5,35 @@ from dotenv import load_dotenv
 load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL")
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "shopping_bot")
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", 8001))
+WORKERS = int(os.getenv("WORKERS", 1))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_TOTAL_POOL_SIZE = int(os.getenv("MONGO_TOTAL_POOL_SIZE") or 0)
+if MONGO_TOTAL_POOL_SIZE:
+    MONGO_MAX_POOL_SIZE = max(1, MONGO_TOTAL_POOL_SIZE // WORKERS)
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 60000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 10000))
+MONGO_USE_TRANSACTIONS = os.getenv("MONGO_USE_TRANSACTIONS", "false").lower() == "true"
+
+LIST_CACHE_SIZE = int(os.getenv("LIST_CACHE_SIZE", 1000))
+LIST_CACHE_TTL = float(os.getenv("LIST_CACHE_TTL", 5.0))
+LIST_CACHE_VALIDATE = (os.getenv("LIST_CACHE_VALIDATE") or str(WORKERS > 1)).lower() == "true"
+LIST_OPS_MAX_RETRIES = int(os.getenv("LIST_OPS_MAX_RETRIES", 5))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 500))
+
+ITEMS_STORAGE = os.getenv("ITEMS_STORAGE", "embedded")
+if ITEMS_STORAGE not in ("embedded", "collection"):
+    raise ValueError(f"ITEMS_STORAGE must be 'embedded' or 'collection', got {ITEMS_STORAGE!r}")
+
+UTILS_COMPACTION_INTERVAL = float(os.getenv("UTILS_COMPACTION_INTERVAL", 3600))
+UTILS_COMPACTION_BATCH_SIZE = int(os.getenv("UTILS_COMPACTION_BATCH_SIZE", 500))
+UTILS_COMPACTION_MAX_DOCS_PER_SECOND = float(os.getenv("UTILS_COMPACTION_MAX_DOCS_PER_SECOND", 1000))
+UTILS_COMPACTION_LEASE_SECONDS = float(os.getenv("UTILS_COMPACTION_LEASE_SECONDS", 300))
@@ -1,34 +1,223 @@
+import asyncio
 import logging
-from datetime import datetime
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from typing import List, Optional
 
+import bson
 from bson.objectid import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DeleteOne, IndexModel, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
-from config import MONGODB_URL
+from cache import ListCache, SingleFlight
+from config import (MONGODB_URL, MONGODB_DATABASE, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+                    MONGO_MAX_IDLE_TIME_MS, MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    MONGO_SOCKET_TIMEOUT_MS, MONGO_USE_TRANSACTIONS, LIST_CACHE_SIZE, LIST_CACHE_TTL,
+                    LIST_CACHE_VALIDATE, LIST_OPS_MAX_RETRIES)
+from metrics import MongoCommandMetrics
 
 logger = logging.getLogger(__name__)
 
+INDEXES = {
+    "users": [IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+              IndexModel([("list_ids", ASCENDING)], name="list_ids")],
+    "utils": [IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True)],
+    "lists": [IndexModel([("items.item_id", ASCENDING)], name="items_item_id"),
+              IndexModel([("users", ASCENDING)], name="users")],
+    "items": [IndexModel([("list_id", ASCENDING), ("position", ASCENDING)], name="list_id_position", unique=True),
+              IndexModel([("list_id", ASCENDING), ("item_id", ASCENDING)], name="list_id_item_id", unique=True)],
+}
+
+ITEMS_EMBEDDED = "embedded"
+ITEMS_COLLECTION = "collection"
+ITEM_PROJECTION = {"_id": 0, "list_id": 0, "position": 0}
+INTERNAL_ITEM_FIELDS = ("sort_key",)
+INTERNAL_LIST_FIELDS = ("items_storage", "next_position", "migrating")
+LIST_LAYOUT_PROJECTION = {"items_storage": 1, "migrating": 1, "version": 1}
+ITEMS_STORAGE_SETTING_ID = "items_storage"
+ITEMS_STORAGE_SETTING_TTL = 30.0
+
+# A migration claim older than this is considered abandoned; writers wait for a claimed list up to
+# MIGRATION_WAIT_SECONDS, polling every MIGRATION_POLL_INTERVAL seconds
+MIGRATION_CLAIM_SECONDS = 60
+MIGRATION_WAIT_SECONDS = 5.0
+MIGRATION_POLL_INTERVAL = 0.05
+
+UTILS_LIST_FIELDS = ("last_list_messages", "current_pages", "skip_confirm")
+COUNTERS_TOTALS_ID = "totals"
+TOTAL_COUNTERS = ("users", "open_lists", "items_added", "items_bought", "lists_completed")
+DAILY_COUNTERS = ("active_users", "new_users", "lists_created", "items_added", "items_bought", "lists_completed")
+
+
+class ListVersionConflict(Exception):
+    pass
+
+
+class ListLayoutChanged(Exception):
+    """Raised by an item write that found its list claimed or moved by a migration."""
+
+
+def new_item(item_name: str) -> dict:
+    return {"item_id": str(ObjectId()), "name": item_name, "bought": False, "sort_key": item_name.casefold()}
+
+
+def item_document(list_id: str, item: dict, position: int) -> dict:
+    return {"list_id": list_id, "position": position, "item_id": item["item_id"], "name": item["name"],
+            "bought": item["bought"], "sort_key": item_sort_key(item)}
+
+
+def uses_items_collection(list_data: dict) -> bool:
+    return list_data.get("items_storage") == ITEMS_COLLECTION
+
+
+def item_sort_key(item: dict) -> str:
+    return item.get("sort_key") or item["name"].casefold()
+
+
+def public_item(item: dict) -> dict:
+    """Drops internal fields such as sort_key that are stored on items but not part of the API."""
+    return {key: value for key, value in item.items() if key not in INTERNAL_ITEM_FIELDS}
+
+
+def public_list(list_data: Optional[dict]) -> Optional[dict]:
+    if not list_data:
+        return list_data
+    list_data = {key: value for key, value in list_data.items() if key not in INTERNAL_LIST_FIELDS}
+    if "items" in list_data:
+        list_data["items"] = [public_item(item) for item in list_data["items"]]
+    return list_data
+
+
+def public_operation_results(results: List[dict]) -> List[dict]:
+    return [{**result, "item": public_item(result["item"])} if "item" in result else result for result in results]
+
+
+def format_list_items(items: list) -> dict:
+    return {str(item["item_id"]): {"name": item["name"], "bought": item["bought"]} for item in items}
+
+
+def apply_item_operations(items: list, operations: List[dict]):
+    items = [dict(item) for item in items]
+    items_by_id = {item["item_id"]: item for item in items}
+    results = []
+    for operation in operations:
+        op = operation["op"]
+        item_id = operation.get("item_id")
+        name = operation.get("name")
+        if op in ("add", "rename") and not name:
+            results.append({"op": op, "item_id": item_id, "ok": False, "error": "name is required"})
+            continue
+        if op == "add":
+            item = new_item(name)
+            items.append(item)
+            items_by_id[item["item_id"]] = item
+            results.append({"op": op, "item_id": item["item_id"], "ok": True, "item": dict(item)})
+            continue
+        item = items_by_id.get(item_id)
+        if item is None:
+            results.append({"op": op, "item_id": item_id, "ok": False, "error": "item not found"})
+            continue
+        if op == "toggle":
+            item["bought"] = not item["bought"]
+        elif op == "rename":
+            item["name"] = name
+            item["sort_key"] = name.casefold()
+        elif op == "delete":
+            items.remove(item)
+            del items_by_id[item_id]
+        # Each result keeps the item as this operation left it, not as the whole batch did
+        results.append({"op": op, "item_id": item_id, "ok": True, "item": dict(item)})
+    return items, results
+
+
+def paginate_items(items: list, bought: int, page: int, page_size: int) -> dict:
+    total = len(items)
+    total_pages = (total + page_size - 1) // page_size if total > 0 else 0
+    page = max(1, min(page, total_pages)) if total_pages > 0 else 1
+    start = (page - 1) * page_size
+    return {"items": items[start:start + page_size], "page": page, "page_size": page_size, "total": total,
+            "bought": bought, "total_pages": total_pages}
+
+
+def daily_counters_id(day: str) -> str:
+    return f"day:{day}"
+
+
+def list_etag(list_data: dict) -> str:
+    return f'"{list_data["_id"]}-{list_data.get("version", 0)}"'
+
 
 class Database:
     def __init__(self):
-        self.client = AsyncIOMotorClient(MONGODB_URL)
-        self.db = self.client.shopping_bot
+        self.client = AsyncIOMotorClient(MONGODB_URL, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE,
+                                         maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS, connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                                         serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                                         socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                                         event_listeners=[MongoCommandMetrics()])
+        self.db = self.client[MONGODB_DATABASE]
         self.users = self.db.users
         self.lists = self.db.lists
         self.utils = self.db.utils
+        self.jobs = self.db.jobs
+        self.items = self.db.items
+        self.counters = self.db.counters
+        self.settings = self.db.settings
+        self.items_storage = None
+        self.items_storage_read_at = 0.0
+        self.list_reads = SingleFlight("list")
+        self.list_cache = ListCache(LIST_CACHE_SIZE, LIST_CACHE_TTL, on_invalidate=self.list_reads.forget)
+        self.user_reads = SingleFlight("user")
+        self.sorted_items = OrderedDict()
         logger.debug("Database initialized")
 
+    async def ping(self):
+        logger.debug("ping: Pinging MongoDB")
+        await self.db.command("ping")
+        logger.debug("ping: MongoDB is reachable")
+
+    async def ensure_indexes(self):
+        for collection_name, indexes in INDEXES.items():
+            collection = self.db[collection_name]
+            for index in indexes:
+                try:
+                    await collection.create_indexes([index])
+                    logger.debug(f"ensure_indexes: Index {index.document['name']} ensured on {collection_name}")
+                except Exception as e:
+                    logger.error(f"ensure_indexes: Failed to create index {index.document['name']} on {collection_name}: {e}")
+
+    def query_shapes(self):
+        sample_id = ObjectId()
+        return [("get_user", self.users, {"user_id": 0}),
+                ("get_utils", self.utils, {"user_id": 0}),
+                ("get_list", self.lists, {"_id": sample_id}),
+                ("complete_list_users", self.users, {"list_ids": str(sample_id)}),
+                ("get_user_lists", self.lists, {"_id": {"$in": [sample_id, ObjectId()]}}),
+                ("toggle_shopping_item", self.lists, {"_id": sample_id, "items.item_id": str(sample_id)}),
+                ("compact_utils_batch", self.utils, {"_id": {"$gt": sample_id}}),
+                ("load_items", self.items, {"list_id": str(sample_id)}),
+                ("update_item", self.items, {"list_id": str(sample_id), "item_id": str(sample_id)})]
+
+    def close(self):
+        self.client.close()
+        logger.debug("close: MongoDB client closed")
+
     async def get_user(self, user_id):
         logger.debug(f"get_user: user_id={user_id}")
-        user = await self.users.find_one({"user_id": user_id})
+        user = await self.user_reads.do(user_id, lambda: self._find_user(user_id))
         if user:
-            user["_id"] = str(user.get("_id"))
             logger.debug(f"get_user: User found: {user}")
         else:
             logger.debug(f"get_user: User not found for user_id={user_id}")
         return user
 
+    async def _find_user(self, user_id):
+        user = await self.users.find_one({"user_id": user_id})
+        if user:
+            user["_id"] = str(user.get("_id"))
+        return user
+
     async def get_last_subscribed_list_id(self, user_id: int) -> Optional[str]:
         logger.debug(f"get_last_subscribed_list_id: user_id={user_id}")
         user = await self.users.find_one({"user_id": user_id})
@@ -42,11 +231,13 @@ class Database:
     async def set_last_subscribed_list_id(self, user_id: int, list_id: str):
         logger.debug(f"set_last_subscribed_list_id: user_id={user_id}, list_id={list_id}")
         await self.users.update_one({"user_id": user_id}, {"$set": {"last_subscribed_list_id": list_id}}, upsert=True)
+        self.user_reads.forget(user_id)
         logger.debug(f"set_last_subscribed_list_id: User {user_id}, last_subscribed_list_id set to {list_id}")
 
     async def clear_last_subscribed_list_id(self, user_id: int):
         logger.debug(f"clear_last_subscribed_list_id: user_id={user_id}")
         await self.users.update_one({"user_id": user_id}, {"$unset": {"last_subscribed_list_id": 1}})
+        self.user_reads.forget(user_id)
         logger.debug(f"clear_last_subscribed_list_id: User {user_id}, last_subscribed_list_id cleared.")
 
     async def delete_last_list_message(self, user_id: int, list_id: str, message_id: int):
@@ -95,45 +286,78 @@ class Database:
         await self.utils.update_one({"user_id": user_id}, {"$unset": {f"current_pages.{list_id}": ""}})
         logger.debug(f"delete_current_page: Current page deleted for user_id={user_id}, list_id={list_id}")
 
-    async def update_user_action(self, user_id, chat_id, username):
+    async def update_user_action(self, user_id, chat_id=None, username=None):
         timestamp = datetime.now().isoformat()
         logger.debug(f"update_user_action: user_id={user_id}, chat_id={chat_id}, username={username}")
-        user = await self.users.find_one({"user_id": user_id})
-        actions = user.get("last_actions", []) if user else []
-        actions = [timestamp] + actions[:2]
-
-        await self.users.update_one({"user_id": user_id},
-            {"$set": {"chat_id": chat_id, "username": username, "last_actions": actions}}, upsert=True)
+        update = {"$push": {"last_actions": {"$each": [timestamp], "$position": 0, "$slice": 3}}}
+        profile = {key: value for key, value in (("chat_id", chat_id), ("username", username)) if value is not None}
+        if profile:
+            update["$set"] = profile
+        previous = await self.users.find_one_and_update({"user_id": user_id}, update, {"last_actions": {"$slice": 1}},
+                                                        upsert=True)
+        self.user_reads.forget(user_id)
         logger.debug(f"update_user_action: User action updated for user_id={user_id}")
+        if previous is None:
+            await self._record_counters({"users": 1}, {"new_users": 1, "active_users": 1})
+        elif not (previous.get("last_actions") or [""])[0].startswith(timestamp[:10]):
+            await self._record_counters(daily={"active_users": 1})
 
     async def create_new_list(self, user_id):
         logger.debug(f"create_new_list: user_id={user_id}")
-        result = await self.lists.insert_one(
-            {"owner_id": user_id, "users": [user_id], "items": [], "completed": False, "last_notification_text": None})
+        list_data = {"owner_id": user_id, "users": [user_id], "completed": False, "last_notification_text": None,
+                     "version": 1}
+        if await self.get_items_storage() == ITEMS_COLLECTION:
+            list_data.update({"items_storage": ITEMS_COLLECTION, "next_position": 0})
+        else:
+            list_data["items"] = []
+        result = await self.lists.insert_one(list_data)
         list_id = str(result.inserted_id)
-        await self.users.update_one({"user_id": user_id}, {"$push": {"list_ids": list_id}})
+        await self.users.update_one({"user_id": user_id}, {"$push": {"list_ids": list_id}}, upsert=True)
+        self.user_reads.forget(user_id)
         logger.debug(f"create_new_list: New list created with list_id={list_id} for user_id={user_id}")
+        await self._record_counters({"open_lists": 1}, {"lists_created": 1})
         return list_id
 
-    async def get_user_lists(self, user_id):
-        logger.debug(f"get_user_lists: user_id={user_id}")
-        user = await self.users.find_one({"user_id": user_id})
+    async def get_user_lists(self, user_id, projection: Optional[dict] = None):
+        logger.debug(f"get_user_lists: user_id={user_id}, projection={projection}")
+        user = await self.users.find_one({"user_id": user_id}, {"list_ids": 1})
         list_ids = user.get("list_ids", []) if user else []
-        lists_data = []
-        for list_id in list_ids:
-            list_data = await self.lists.find_one({"_id": ObjectId(list_id)})
-            if list_data:
-                list_data["_id"] = str(list_data["_id"])
-                lists_data.append(list_data)
+        object_ids = [ObjectId(list_id) for list_id in list_ids if ObjectId.is_valid(list_id)]
+        if not object_ids:
+            logger.debug(f"get_user_lists: No lists for user_id={user_id}")
+            return []
+
+        lists_by_id = {}
+        async for list_data in self.lists.find({"_id": {"$in": object_ids}}, projection):
+            list_data["_id"] = str(list_data["_id"])
+            lists_by_id[list_data["_id"]] = list_data
+        if projection is None or projection.get("items", 1):
+            await self._attach_items(
+                [list_data for list_data in lists_by_id.values() if uses_items_collection(list_data)])
+        lists_data = [public_list(lists_by_id[list_id]) for list_id in list_ids if list_id in lists_by_id]
         logger.debug(f"get_user_lists: Returning lists for user_id={user_id}: {lists_data}")
         return lists_data
 
     async def _get_list(self, list_id):
         logger.debug(f"_get_list: list_id={list_id}")
+        list_data = self.list_cache.get(list_id)
+        if list_data is not None and LIST_CACHE_VALIDATE:
+            list_data = await self._validate_cached_list(list_id, list_data)
+        if list_data is not None:
+            logger.debug(f"_get_list: Cache hit for list_id={list_id}, version={list_data.get('version', 0)}")
+            return list_data
+        # Invalidating a list drops its in-flight read, so a read never joins one that started before a write
+        return await self.list_reads.do(list_id, lambda: self._find_list(list_id))
+
+    async def _find_list(self, list_id):
+        read_generation = self.list_cache.begin_read()
         try:
             list_data = await self.lists.find_one({"_id": ObjectId(list_id)})
             if list_data:
                 list_data["_id"] = str(list_data["_id"])
+                if uses_items_collection(list_data):
+                    list_data["items"] = await self._load_items(list_id)
+                self.list_cache.put(list_id, list_data, read_generation)
                 logger.debug(f"_get_list: List found: {list_data}")
                 return list_data
             else:
@@ -143,82 +367,560 @@ class Database:
             logger.error(f"Invalid list_id: {list_id}. Error: {e}")
             return None
 
+    async def _load_items(self, list_id: str, session=None) -> list:
+        return await self.items.find({"list_id": list_id}, ITEM_PROJECTION, session=session).sort(
+            "position", ASCENDING).to_list(None)
+
+    async def _attach_items(self, lists: List[dict]):
+        if not lists:
+            return
+        items_by_list = {list_data["_id"]: [] for list_data in lists}
+        async for item in self.items.find({"list_id": {"$in": list(items_by_list)}}, {"_id": 0}).sort(
+                [("list_id", ASCENDING), ("position", ASCENDING)]):
+            list_id = item.pop("list_id")
+            item.pop("position")
+            items_by_list[list_id].append(item)
+        for list_data in lists:
+            list_data["items"] = items_by_list[list_data["_id"]]
+
+    async def migrate_list_items(self, list_data: dict, storage: str) -> bool:
+        """Moves the items of one list to the given storage layout.
+
+        The list is first claimed with a compare-and-set on ``version`` that sets a ``migrating``
+        marker, so only the winner touches item documents. Item writers wait while the marker is
+        set, and the layout is switched only by the holder of the claim. Returns True when this
+        call moved the list or it already used ``storage``.
+        """
+        list_id = str(list_data["_id"])
+        if uses_items_collection(list_data) == (storage == ITEMS_COLLECTION):
+            return True
+        claimed = await self._claim_migration(list_data, storage)
+        self.list_cache.invalidate(list_id)
+        if claimed is None:
+            logger.warning(f"migrate_list_items: list_id={list_id} changed or is being migrated, not moved to {storage}")
+            return False
+        owner = claimed["migrating"]["owner"]
+        try:
+            if storage == ITEMS_COLLECTION:
+                moved = await self._move_items_to_collection(list_id, owner, claimed.get("items", []))
+            else:
+                moved = await self._move_items_to_embedded(list_id, owner, claimed["version"])
+        except Exception:
+            await self._release_migration(list_id, owner)
+            raise
+        finally:
+            self.list_cache.invalidate(list_id)
+        if not moved:
+            logger.warning(f"migrate_list_items: list_id={list_id} lost its claim during migration to {storage}")
+            return False
+        logger.debug(f"migrate_list_items: Items of list_id={list_id} moved to {storage} storage")
+        return True
+
+    async def _claim_migration(self, list_data: dict, storage: str) -> Optional[dict]:
+        # A claim left by a crashed migration can be taken over once it is older than MIGRATION_CLAIM_SECONDS
+        now = datetime.utcnow()
+        version = list_data.get("version", 0)
+        layout = {"$ne": ITEMS_COLLECTION} if storage == ITEMS_COLLECTION else ITEMS_COLLECTION
+        return await self.lists.find_one_and_update(
+            {"_id": ObjectId(str(list_data["_id"])), "version": version if version else {"$in": [0, None]},
+             "items_storage": layout,
+             "$or": [{"migrating": {"$exists": False}},
+                     {"migrating.at": {"$lt": now - timedelta(seconds=MIGRATION_CLAIM_SECONDS)}}]},
+            {"$set": {"migrating": {"owner": str(ObjectId()), "to": storage, "at": now}}, "$inc": {"version": 1}},
+            return_document=ReturnDocument.AFTER)
+
+    async def _release_migration(self, list_id: str, owner: str):
+        await self.lists.update_one({"_id": ObjectId(list_id), "migrating.owner": owner},
+                                    {"$unset": {"migrating": ""}, "$inc": {"version": 1}})
+
+    async def _move_items_to_collection(self, list_id: str, owner: str, items: list) -> bool:
+        # Embedded writers skip claimed lists, so the claimed document holds the final items. No one else
+        # writes item documents of a list that is not in the collection yet, so leftovers of an
+        # interrupted attempt are dropped and the items are inserted, never upserted over existing ones
+        await self.items.delete_many({"list_id": list_id})
+        if items:
+            await self.items.insert_many([item_document(list_id, item, position)
+                                          for position, item in enumerate(items)], ordered=True)
+        result = await self.lists.update_one(
+            {"_id": ObjectId(list_id), "migrating.owner": owner},
+            {"$set": {"items_storage": ITEMS_COLLECTION, "next_position": len(items)},
+             "$unset": {"items": "", "migrating": ""}, "$inc": {"version": 1}})
+        if result.modified_count:
+            return True
+        if not await self.lists.count_documents({"_id": ObjectId(list_id)}, limit=1):
+            await self.items.delete_many({"list_id": list_id})
+        return False
+
+    async def _move_items_to_embedded(self, list_id: str, owner: str, version: int) -> bool:
+        # Collection writers that got past the claim still bump the version after writing their items,
+        # so the switch is retried with a fresh copy of the items until no such write slipped in
+        for attempt in range(LIST_OPS_MAX_RETRIES):
+            items = await self._load_items(list_id)
+            result = await self.lists.update_one(
+                {"_id": ObjectId(list_id), "migrating.owner": owner, "version": version},
+                {"$set": {"items": items}, "$unset": {"items_storage": "", "next_position": "", "migrating": ""},
+                 "$inc": {"version": 1}})
+            if result.modified_count:
+                await self.items.delete_many({"list_id": list_id})
+                return True
+            current = await self.lists.find_one({"_id": ObjectId(list_id), "migrating.owner": owner}, {"version": 1})
+            if current is None:
+                return False
+            version = current["version"]
+        await self._release_migration(list_id, owner)
+        return False
+
+    async def get_items_storage(self) -> str:
+        """Returns the persisted target layout for list items.
+
+        All workers read the same setting, so workers started with different ITEMS_STORAGE values
+        never move a list back and forth. The value is cached for ITEMS_STORAGE_SETTING_TTL seconds.
+        """
+        now = time.monotonic()
+        if self.items_storage is None or now - self.items_storage_read_at > ITEMS_STORAGE_SETTING_TTL:
+            setting = await self.settings.find_one({"_id": ITEMS_STORAGE_SETTING_ID})
+            self.items_storage = setting["value"] if setting else ITEMS_EMBEDDED
+            self.items_storage_read_at = now
+        return self.items_storage
+
+    async def init_items_storage(self, storage: str) -> str:
+        """Persists ``storage`` as the target layout unless one is set already; returns the persisted one."""
+        try:
+            await self.settings.update_one({"_id": ITEMS_STORAGE_SETTING_ID}, {"$setOnInsert": {"value": storage}},
+                                           upsert=True)
+        except DuplicateKeyError:
+            pass
+        self.items_storage = None
+        persisted = await self.get_items_storage()
+        if persisted != storage:
+            logger.warning(f"init_items_storage: ITEMS_STORAGE={storage} ignored, lists target {persisted} "
+                           f"storage until migrate_items.py switches them")
+        return persisted
+
+    async def set_items_storage(self, storage: str):
+        await self.settings.update_one({"_id": ITEMS_STORAGE_SETTING_ID}, {"$set": {"value": storage}}, upsert=True)
+        self.items_storage, self.items_storage_read_at = storage, time.monotonic()
+        logger.debug(f"set_items_storage: Lists now target {storage} storage")
+
+    async def ensure_list_storage(self, list_id: str, storage: Optional[str] = None) -> bool:
+        """Waits until no migration holds the list and moves it to ``storage`` when one is given.
+
+        Claims older than MIGRATION_CLAIM_SECONDS are released. Returns False when the list does not
+        exist, or is still claimed or not in ``storage`` after MIGRATION_WAIT_SECONDS.
+        """
+        deadline = time.monotonic() + MIGRATION_WAIT_SECONDS
+        while True:
+            layout = await self.lists.find_one({"_id": ObjectId(list_id)}, LIST_LAYOUT_PROJECTION)
+            if layout is None:
+                return False
+            migrating = layout.get("migrating")
+            if migrating and migrating["at"] < datetime.utcnow() - timedelta(seconds=MIGRATION_CLAIM_SECONDS):
+                await self._release_migration(list_id, migrating["owner"])
+                continue
+            if not migrating:
+                if storage is None or uses_items_collection(layout) == (storage == ITEMS_COLLECTION):
+                    return True
+                if await self.migrate_list_items(layout, storage):
+                    return True
+            if time.monotonic() > deadline:
+                logger.warning(f"ensure_list_storage: list_id={list_id} is still not ready for {storage or 'writes'}")
+                return False
+            await asyncio.sleep(MIGRATION_POLL_INTERVAL)
+
+    async def _writable_list(self, list_id: str) -> Optional[dict]:
+        # Lists are moved to collection storage lazily once it is the persisted target. Moving them back to
+        # embedded storage is left to migrate_items.py: writes follow whatever layout the list has
+        list_data = await self._get_list(list_id)
+        if not list_data:
+            return None
+        lagging = not uses_items_collection(list_data) and await self.get_items_storage() == ITEMS_COLLECTION
+        if lagging or list_data.get("migrating"):
+            if not await self.ensure_list_storage(list_id, ITEMS_COLLECTION if lagging else None):
+                return None
+            self.list_cache.invalidate(list_id)
+            list_data = await self._get_list(list_id)
+        return list_data
+
+    async def _write_items(self, name: str, list_id: str, embedded_write, collection_write):
+        """Runs an item write on the code path of the list's layout.
+
+        A write that finds the list claimed or moved by a migration raises ListLayoutChanged and is
+        retried on the new layout, up to LIST_OPS_MAX_RETRIES times. Returns None when the list is
+        missing or the retries ran out.
+        """
+        for attempt in range(LIST_OPS_MAX_RETRIES):
+            list_data = await self._writable_list(list_id)
+            if not list_data:
+                return None
+            try:
+                if uses_items_collection(list_data):
+                    return await collection_write()
+                return await embedded_write()
+            except ListLayoutChanged:
+                logger.debug(f"{name}: Layout of list_id={list_id} changed, attempt {attempt + 1}")
+                self.list_cache.invalidate(list_id)
+        logger.warning(f"{name}: Giving up after {LIST_OPS_MAX_RETRIES} layout changes on list_id={list_id}")
+        return None
+
+    async def _check_layout(self, list_id: str, in_collection: bool):
+        # Called when a write matched nothing, to tell a missing list or item apart from a migration
+        layout = await self.lists.find_one({"_id": ObjectId(list_id)}, LIST_LAYOUT_PROJECTION)
+        if layout and (layout.get("migrating") or uses_items_collection(layout) != in_collection):
+            raise ListLayoutChanged(list_id)
+
+    async def _embedded_list_update(self, list_id: str, query: dict, update) -> Optional[dict]:
+        query = {"_id": ObjectId(list_id), **query, "items_storage": {"$ne": ITEMS_COLLECTION},
+                 "migrating": {"$exists": False}}
+        list_data = await self.lists.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if list_data is None:
+            await self._check_layout(list_id, in_collection=False)
+        return list_data
+
+    async def _reserve_positions(self, list_id: str, count: int) -> Optional[int]:
+        list_data = await self.lists.find_one_and_update(
+            {"_id": ObjectId(list_id), "items_storage": ITEMS_COLLECTION, "migrating": {"$exists": False}},
+            {"$inc": {"next_position": count}}, {"next_position": 1}, return_document=ReturnDocument.AFTER)
+        if list_data is None:
+            await self._check_layout(list_id, in_collection=True)
+            return None
+        return list_data["next_position"] - count
+
+    async def _commit_items_change(self, list_id: str) -> Optional[dict]:
+        # Items are written before the version is bumped, so a reader caching the old version can never
+        # store the new items under a version that later writes would not supersede. The commit fails
+        # when the list left collection storage meanwhile; callers then check what the migration copied
+        list_data = await self.lists.find_one_and_update({"_id": ObjectId(list_id), "items_storage": ITEMS_COLLECTION},
+                                                         {"$inc": {"version": 1}}, return_document=ReturnDocument.AFTER)
+        if list_data:
+            list_data["items"] = await self._load_items(list_id)
+        return self._store_updated_list(list_id, list_data)
+
+    async def _insert_collection_items(self, list_id: str, items: list) -> Optional[dict]:
+        """Inserts new items of a list kept in collection storage.
+
+        If the list is moved to embedded storage before the commit, item documents the migration did
+        not copy are removed again and ListLayoutChanged is raised with only those items left in
+        ``items``, so the retry adds every item exactly once.
+        """
+        position = await self._reserve_positions(list_id, len(items))
+        if position is None:
+            return None
+        await self.items.insert_many([item_document(list_id, item, position + offset)
+                                      for offset, item in enumerate(items)])
+        list_data = await self._commit_items_change(list_id)
+        if list_data is not None:
+            return list_data
+        stored = await self.lists.find_one({"_id": ObjectId(list_id)})
+        if stored is not None and uses_items_collection(stored):
+            return await self._commit_items_change(list_id)
+        copied = {item["item_id"] for item in stored.get("items", [])} if stored else set()
+        missing = [item for item in items if item["item_id"] not in copied]
+        if missing:
+            await self.items.delete_many({"list_id": list_id,
+                                          "item_id": {"$in": [item["item_id"] for item in missing]}})
+        if stored is None:
+            return None
+        if missing:
+            items[:] = missing
+            raise ListLayoutChanged(list_id)
+        return self._store_updated_list(list_id, stored)
+
+    async def _validate_cached_list(self, list_id: str, list_data: dict):
+        # Other workers only invalidate their own caches, so a hit is confirmed by reading just the version
+        current = await self.lists.find_one({"_id": ObjectId(list_id)}, {"version": 1})
+        if current is not None and current.get("version", 0) == list_data.get("version", 0):
+            return list_data
+        logger.debug(f"_validate_cached_list: Cached version {list_data.get('version', 0)} is stale "
+                     f"for list_id={list_id}")
+        self.list_cache.reject(list_id)
+        return None
+
+    def get_sorted_items(self, list_data: dict, sort: str = "insertion"):
+        key = (list_data["_id"], list_data.get("version", 0), sort)
+        cached = self.sorted_items.get(key)
+        if cached is not None:
+            self.sorted_items.move_to_end(key)
+            return cached
+        items = list_data.get("items", [])
+        if sort == "name":
+            items = sorted(items, key=item_sort_key)
+        items = [public_item(item) for item in items]
+        cached = (items, sum(1 for item in items if item["bought"]))
+        if self.list_cache.enabled:
+            self.sorted_items[key] = cached
+            while len(self.sorted_items) > self.list_cache.max_size:
+                self.sorted_items.popitem(last=False)
+        return cached
+
+    async def get_list_view(self, user_id: int, list_id: str, page: Optional[int] = None, page_size: int = 6,
+                            sort: str = "insertion"):
+        logger.debug(f"get_list_view: user_id={user_id}, list_id={list_id}, page={page}, sort={sort}")
+        list_data = await self._get_list(list_id)
+        if not list_data:
+            logger.debug(f"get_list_view: List not found for list_id={list_id}")
+            return None
+
+        view = {"list": list_data, "owner_username": None, "current_page": 1, "skip_confirm": False,
+                "last_message_ids": []}
+        pipeline = [{"$match": {"user_id": list_data["owner_id"]}},
+                    {"$project": {"_id": 0, "source": {"$literal": "users"}, "username": 1}},
+                    {"$unionWith": {"coll": self.utils.name, "pipeline": [
+                        {"$match": {"user_id": user_id}},
+                        {"$project": {"_id": 0, "source": {"$literal": "utils"},
+                                      "current_page": f"$current_pages.{list_id}",
+                                      "skip_confirm": f"$skip_confirm.{list_id}",
+                                      "last_message_ids": f"$last_list_messages.{list_id}"}}]}}]
+        async for doc in self.users.aggregate(pipeline):
+            if doc["source"] == "users":
+                view["owner_username"] = doc.get("username")
+            else:
+                view["current_page"] = doc.get("current_page", 1)
+                view["skip_confirm"] = doc.get("skip_confirm", False)
+                view["last_message_ids"] = doc.get("last_message_ids", [])
+
+        items, bought = self.get_sorted_items(list_data, sort)
+        view["list"] = public_list({**list_data, "items": items})
+        view["items_page"] = paginate_items(items, bought, page or view["current_page"], page_size)
+        logger.debug(f"get_list_view: Returning view for user_id={user_id}, list_id={list_id}: {view}")
+        return view
+
     async def get_list_items(self, list_id):
         logger.debug(f"get_list_items: list_id={list_id}")
         list_data = await self._get_list(list_id)
         if list_data:
-            items = {str(item["item_id"]): {"name": item["name"], "bought": item["bought"]} for item in
-                     list_data.get("items", [])}
+            items = format_list_items(list_data.get("items", []))
             logger.debug(f"get_list_items: Returning items for list_id={list_id}: {items}")
             return items
         logger.debug(f"get_list_items: No list data found for list_id={list_id}, returning empty dict.")
         return {}
 
+    def _store_updated_list(self, list_id, list_data):
+        if not list_data:
+            self.list_cache.invalidate(list_id)
+            return None
+        list_data["_id"] = str(list_data["_id"])
+        self.list_cache.refresh(list_id, list_data)
+        return list_data
+
     async def add_shopping_item(self, list_id, item_name):
-        item_id = str(ObjectId())
+        item = new_item(item_name)
+        item_id = item["item_id"]
         logger.debug(f"add_shopping_item: list_id={list_id}, item_name={item_name}, item_id={item_id}")
-        await self.lists.update_one({"_id": ObjectId(list_id)},
-            {"$push": {"items": {"item_id": item_id, "name": item_name, "bought": False}}})
+
+        async def embedded_write():
+            return self._store_updated_list(list_id, await self._embedded_list_update(
+                list_id, {}, {"$push": {"items": item}, "$inc": {"version": 1}}))
+
+        list_data = await self._write_items("add_shopping_item", list_id, embedded_write,
+                                            lambda: self._insert_collection_items(list_id, [item]))
         logger.debug(f"add_shopping_item: Item added to list_id={list_id}, item_id={item_id}")
-        return item_id
+        if list_data:
+            await self._record_counters({"items_added": 1}, {"items_added": 1})
+        return item_id, list_data
 
     async def toggle_shopping_item(self, list_id, item_id):
         logger.debug(f"toggle_shopping_item: list_id={list_id}, item_id={item_id}")
-        list_data = await self.lists.find_one({"_id": ObjectId(list_id), "items.item_id": item_id}, {"items.$": 1})
-        if not list_data or not list_data.get("items"):
+
+        async def embedded_write():
+            list_data = await self._embedded_list_update(list_id, {"items.item_id": item_id}, [{
+                "$set": {"items": {"$map": {"input": "$items", "as": "item", "in": {
+                    "$cond": [{"$eq": ["$$item.item_id", item_id]},
+                              {"$mergeObjects": ["$$item", {"bought": {"$not": ["$$item.bought"]}}]}, "$$item"]}}},
+                         "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}}])
+            list_data = self._store_updated_list(list_id, list_data)
+            item = next((item for item in list_data.get("items", []) if item["item_id"] == item_id),
+                        None) if list_data else None
+            return item, list_data
+
+        result = await self._write_items("toggle_shopping_item", list_id, embedded_write,
+                                         lambda: self._toggle_collection_item(list_id, item_id))
+        item, list_data = result or (None, None)
+        if not item:
             logger.warning(
                 f"toggle_shopping_item: List data or items not found for list_id={list_id}, item_id={item_id}")
-            return
+            return None, None
 
-        current_bought_status = list_data["items"][0]["bought"]
-        new_bought_status = not current_bought_status
-
-        await self.lists.update_one({"_id": ObjectId(list_id), "items.item_id": item_id},
-            {"$set": {"items.$.bought": new_bought_status}})
         logger.debug(
-            f"toggle_shopping_item: Item toggled in list_id={list_id}, item_id={item_id}, new_bought_status={new_bought_status}")
+            f"toggle_shopping_item: Item toggled in list_id={list_id}, item_id={item_id}, new_bought_status={item['bought']}")
+        if item["bought"]:
+            await self._record_counters({"items_bought": 1}, {"items_bought": 1})
+        return item, list_data
+
+    async def _toggle_collection_item(self, list_id, item_id):
+        item = await self.items.find_one_and_update({"list_id": list_id, "item_id": item_id},
+                                                    [{"$set": {"bought": {"$not": ["$bought"]}}}], ITEM_PROJECTION,
+                                                    return_document=ReturnDocument.AFTER)
+        if not item:
+            await self._check_layout(list_id, in_collection=True)
+            return None, None
+        list_data = await self._commit_items_change(list_id)
+        if list_data is None:
+            # The list left collection storage meanwhile: the toggle stands only if the migration copied it
+            stored = await self.lists.find_one({"_id": ObjectId(list_id)})
+            if stored is None:
+                return None, None
+            copied = next((copied for copied in stored.get("items", []) if copied["item_id"] == item_id), None)
+            if copied is None or copied["bought"] != item["bought"]:
+                raise ListLayoutChanged(list_id)
+            list_data = self._store_updated_list(list_id, stored)
+        return item, list_data
 
     async def delete_shopping_item(self, list_id, item_id):
         logger.debug(f"delete_shopping_item: list_id={list_id}, item_id={item_id}")
-        await self.lists.update_one({"_id": ObjectId(list_id)}, {"$pull": {"items": {"item_id": item_id}}})
+
+        async def embedded_write():
+            return self._store_updated_list(list_id, await self._embedded_list_update(
+                list_id, {}, {"$pull": {"items": {"item_id": item_id}}, "$inc": {"version": 1}}))
+
+        list_data = await self._write_items("delete_shopping_item", list_id, embedded_write,
+                                            lambda: self._delete_collection_item(list_id, item_id))
         logger.debug(f"delete_shopping_item: Item deleted from list_id={list_id}, item_id={item_id}")
+        return list_data
+
+    async def _delete_collection_item(self, list_id, item_id):
+        await self.items.delete_one({"list_id": list_id, "item_id": item_id})
+        list_data = await self._commit_items_change(list_id)
+        if list_data is None:
+            # The list left collection storage meanwhile: retry unless the migration copied the deletion
+            stored = await self.lists.find_one({"_id": ObjectId(list_id)})
+            if stored is None:
+                return None
+            if any(item["item_id"] == item_id for item in stored.get("items", [])):
+                raise ListLayoutChanged(list_id)
+            list_data = self._store_updated_list(list_id, stored)
+        return list_data
+
+    async def apply_list_operations(self, list_id, operations: List[dict], user_id: Optional[int] = None):
+        logger.debug(f"apply_list_operations: list_id={list_id}, operations={operations}, user_id={user_id}")
+        for attempt in range(LIST_OPS_MAX_RETRIES):
+            list_data = await self._writable_list(list_id)
+            if not list_data:
+                logger.warning(f"apply_list_operations: List not found for list_id={list_id}")
+                return None, None
+            if uses_items_collection(list_data):
+                try:
+                    return await self._apply_collection_operations(list_id, list_data, operations, user_id)
+                except ListLayoutChanged:
+                    logger.debug(f"apply_list_operations: Layout of list_id={list_id} changed, attempt {attempt + 1}")
+                    self.list_cache.invalidate(list_id)
+                    continue
+            items, results = apply_item_operations(list_data.get("items", []), operations)
+            version = list_data.get("version", 0)
+            updated = await self.lists.find_one_and_update(
+                {"_id": ObjectId(list_id), "version": version if version else {"$in": [0, None]},
+                 "items_storage": {"$ne": ITEMS_COLLECTION}, "migrating": {"$exists": False}},
+                {"$set": {"items": items}, "$inc": {"version": 1}}, return_document=ReturnDocument.AFTER)
+            if updated:
+                updated = self._store_updated_list(list_id, updated)
+                if user_id is not None and any(result["ok"] for result in results):
+                    await self.delete_skip_confirm(user_id, list_id)
+                await self._record_operation_counters(results)
+                logger.debug(
+                    f"apply_list_operations: {len(operations)} operations applied to list_id={list_id}, version={updated.get('version')}")
+                return results, updated
+            logger.debug(f"apply_list_operations: Version conflict on list_id={list_id}, attempt {attempt + 1}")
+            self.list_cache.invalidate(list_id)
+        logger.warning(f"apply_list_operations: Giving up after {LIST_OPS_MAX_RETRIES} conflicts on list_id={list_id}")
+        raise ListVersionConflict(list_id)
+
+    async def _apply_collection_operations(self, list_id, list_data: dict, operations: List[dict],
+                                           user_id: Optional[int] = None):
+        # Every operation is an atomic write of one item document, so no version check is needed
+        _, results = apply_item_operations(list_data.get("items", []), operations)
+        added = sum(1 for result in results if result["ok"] and result["op"] == "add")
+        position = await self._reserve_positions(list_id, added) if added else 0
+        if position is None:
+            return None, None
+        requests = []
+        added_ids = []
+        for operation, result in zip(operations, results):
+            if not result["ok"]:
+                continue
+            query = {"list_id": list_id, "item_id": result["item_id"]}
+            if operation["op"] == "add":
+                item = {"item_id": result["item_id"], "name": operation["name"], "bought": False}
+                requests.append(InsertOne(item_document(list_id, item, position)))
+                added_ids.append(result["item_id"])
+                position += 1
+            elif operation["op"] == "toggle":
+                requests.append(UpdateOne(query, [{"$set": {"bought": {"$not": ["$bought"]}}}]))
+            elif operation["op"] == "rename":
+                requests.append(UpdateOne(query, {"$set": {"name": operation["name"],
+                                                           "sort_key": operation["name"].casefold()}}))
+            elif operation["op"] == "delete":
+                requests.append(DeleteOne(query))
+        if requests:
+            await self.items.bulk_write(requests, ordered=True)
+        updated = await self._commit_items_change(list_id)
+        if not updated:
+            # The list was completed or moved to embedded storage meanwhile, so only part of the batch may
+            # have been copied: added items that were not are removed and the caller has to re-read the list
+            stored = await self.lists.find_one({"_id": ObjectId(list_id)}, {"items.item_id": 1, "items_storage": 1})
+            if stored is None or not uses_items_collection(stored):
+                copied = {item["item_id"] for item in stored.get("items", [])} if stored else set()
+                await self.items.delete_many({"list_id": list_id, "item_id": {
+                    "$in": [item_id for item_id in added_ids if item_id not in copied]}})
+            if stored is None:
+                return None, None
+            raise ListVersionConflict(list_id)
+        if user_id is not None and requests:
+            await self.delete_skip_confirm(user_id, list_id)
+        await self._record_operation_counters(results)
+        logger.debug(f"apply_list_operations: {len(operations)} operations applied to list_id={list_id}, "
+                     f"version={updated.get('version')}")
+        return results, updated
 
     async def complete_list(self, list_id):
         logger.debug(f"complete_list: list_id={list_id}")
-        list_data = await self._get_list(list_id)
+        if not ObjectId.is_valid(list_id):
+            logger.warning(f"complete_list: Invalid list_id={list_id}")
+            return None, {}, {}
+
+        try:
+            if MONGO_USE_TRANSACTIONS:
+                async with await self.client.start_session() as session:
+                    async with session.start_transaction():
+                        result = await self._complete_list(list_id, session)
+            else:
+                result = await self._complete_list(list_id)
+        finally:
+            self.list_cache.invalidate(list_id)
+        if result[0] is not None:
+            await self._record_counters({"open_lists": -1, "lists_completed": 1}, {"lists_completed": 1})
+        return result
+
+    async def _complete_list(self, list_id, session=None):
+        list_data = await self.lists.find_one_and_update({"_id": ObjectId(list_id)}, {"$set": {"completed": True}, "$inc": {"version": 1}},
+                                                         return_document=ReturnDocument.AFTER, session=session)
         if not list_data:
             logger.warning(f"complete_list: List data not found for list_id={list_id}")
             return None, {}, {}
-
-        await self.lists.update_one({"_id": ObjectId(list_id)}, {"$set": {"completed": True}})
         logger.debug(f"complete_list: List completed: list_id={list_id}")
+        items = list_data.get("items", [])
+        if uses_items_collection(list_data):
+            items = await self._load_items(list_id, session=session)
+            await self.items.delete_many({"list_id": list_id}, session=session)
 
         users_in_list = list_data["users"]
-        last_message_ids_for_users = {}
+        last_message_ids_for_users = {user_id: [] for user_id in users_in_list}
+        async for data in self.utils.find({"user_id": {"$in": users_in_list}},
+                                          {"user_id": 1, f"last_list_messages.{list_id}": 1}, session=session):
+            last_message_ids_for_users[data["user_id"]] = data.get("last_list_messages", {}).get(list_id, [])
+        logger.debug(f"complete_list: last_message_ids found: {last_message_ids_for_users}")
 
-        for user_id in users_in_list:
-            data = await self.utils.find_one({"user_id": user_id})
-            if data and "last_list_messages" in data and list_id in data["last_list_messages"]:
-                last_message_ids_for_users[user_id] = data["last_list_messages"][list_id]
-            else:
-                last_message_ids_for_users[user_id] = []
-            logger.debug(
-                f"complete_list: User {user_id}, last_message_ids found: {last_message_ids_for_users.get(user_id)}")
-
-        for user_id in users_in_list:
-            await self.users.update_one({"user_id": user_id}, {"$pull": {"list_ids": list_id}})
-            logger.debug(f"complete_list: List ID removed from user {user_id}'s list_ids.")
+        await self.users.update_many({"list_ids": list_id}, {"$pull": {"list_ids": list_id}}, session=session)
+        self.user_reads.forget()
+        logger.debug(f"complete_list: List ID removed from list_ids of all users for list_id={list_id}.")
 
-        for user_id in users_in_list:
-            await self.utils.update_one({"user_id": user_id}, {
-                "$unset": {f"last_list_messages.{list_id}": "", f"current_pages.{list_id}": "",
-                    f"skip_confirm.{list_id}": "", f"last_notification_text.{list_id}": ""}})
-            logger.debug(f"complete_list: List-specific data removed from utils for user {user_id}.")
+        await self.utils.update_many({"user_id": {"$in": users_in_list}}, {
+            "$unset": {f"last_list_messages.{list_id}": "", f"current_pages.{list_id}": "",
+                f"skip_confirm.{list_id}": "", f"last_notification_text.{list_id}": ""}}, session=session)
+        logger.debug(f"complete_list: List-specific data removed from utils for users {users_in_list}.")
 
-        await self.lists.delete_one({"_id": ObjectId(list_id)})
+        await self.lists.delete_one({"_id": ObjectId(list_id)}, session=session)
         logger.debug(f"complete_list: List deleted from lists collection: list_id={list_id}")
 
-        return users_in_list, list_data.get("items", []), last_message_ids_for_users
+        return users_in_list, items, last_message_ids_for_users
 
     async def get_skip_confirm(self, user_id: int, list_id: str) -> bool:
         logger.debug(f"get_skip_confirm: user_id={user_id}, list_id={list_id}")
@@ -262,8 +964,10 @@ class Database:
         except:
             pass
 
-        await self.lists.update_one({"_id": ObjectId(list_id)}, {"$push": {"users": user_id}})
+        await self.lists.update_one({"_id": ObjectId(list_id)}, {"$push": {"users": user_id}, "$inc": {"version": 1}})
+        self.list_cache.invalidate(list_id)
         await self.users.update_one({"user_id": user_id}, {"$push": {"list_ids": list_id}}, upsert=True)
+        self.user_reads.forget(user_id)
         await self.set_last_subscribed_list_id(user_id, list_id)
         logger.debug(f"share_list: User {user_id} added to list_id={list_id}")
         return True
@@ -284,10 +988,12 @@ class Database:
                 f"unsubscribe_user_from_list: Owner cannot unsubscribe: user_id={user_id}, list_id={list_id}")
             return False
 
-        await self.lists.update_one({"_id": ObjectId(list_id)}, {"$pull": {"users": user_id}})
+        await self.lists.update_one({"_id": ObjectId(list_id)}, {"$pull": {"users": user_id}, "$inc": {"version": 1}})
+        self.list_cache.invalidate(list_id)
         await self.users.update_one({"user_id": user_id}, {"$pull": {"list_ids": list_id}})
-        await self.delete_current_page(user_id, list_id)
-        await self.delete_last_list_message(user_id, list_id, -1)
+        self.user_reads.forget(user_id)
+        await self.utils.update_one({"user_id": user_id},
+                                    {"$unset": {f"{field}.{list_id}": "" for field in UTILS_LIST_FIELDS}})
         await self.clear_last_subscribed_list_id(user_id)
         logger.debug(f"unsubscribe_user_from_list: User {user_id} unsubscribed from list_id={list_id}")
         return True
@@ -306,24 +1012,166 @@ class Database:
 
     async def set_list_notification_text(self, list_id: str, notification_text: str):
         logger.debug(f"set_list_notification_text: list_id={list_id}, notification_text={notification_text}")
-        await self.lists.update_one({"_id": ObjectId(list_id)}, {"$set": {"last_notification_text": notification_text}})
+        await self.lists.update_one({"_id": ObjectId(list_id)},
+                                    {"$set": {"last_notification_text": notification_text}, "$inc": {"version": 1}})
+        self.list_cache.invalidate(list_id)
         logger.debug(f"set_list_notification_text: Notification text set for list_id={list_id}")
 
     async def clear_list_notification_text(self, list_id: str):
         logger.debug(f"clear_list_notification_text: list_id={list_id}")
-        await self.lists.update_one({"_id": ObjectId(list_id)}, {"$set": {"last_notification_text": None}})
+        await self.lists.update_one({"_id": ObjectId(list_id)},
+                                    {"$set": {"last_notification_text": None}, "$inc": {"version": 1}})
+        self.list_cache.invalidate(list_id)
         logger.debug(f"clear_list_notification_text: Notification text cleared for list_id={list_id}")
 
     async def add_shopping_items_bulk(self, list_id, item_names: List[str]):
         logger.debug(f"add_shopping_items_bulk: list_id={list_id}, item_names={item_names}")
-        items_to_insert = []
-        for item_name in item_names:
-            item_id = str(ObjectId())
-            items_to_insert.append({"item_id": item_id, "name": item_name, "bought": False})
+        items_to_insert = [new_item(item_name) for item_name in item_names]
 
         if not items_to_insert:
-            return []
+            return [], await self._get_list(list_id)
+
+        count = len(items_to_insert)
+
+        async def embedded_write():
+            return self._store_updated_list(list_id, await self._embedded_list_update(
+                list_id, {}, {"$push": {"items": {"$each": items_to_insert}}, "$inc": {"version": 1}}))
+
+        list_data = await self._write_items("add_shopping_items_bulk", list_id, embedded_write,
+                                            lambda: self._insert_collection_items(list_id, items_to_insert))
+        logger.debug(f"add_shopping_items_bulk: {count} items added to list_id={list_id}")
+        if list_data:
+            await self._record_counters({"items_added": count}, {"items_added": count})
+        return item_names, list_data
+
+    async def _record_counters(self, totals: Optional[dict] = None, daily: Optional[dict] = None):
+        """Increments the all-time and today's counters in one round trip; failures are only logged."""
+        requests = []
+        if totals:
+            requests.append(UpdateOne({"_id": COUNTERS_TOTALS_ID}, {"$inc": totals}, upsert=True))
+        if daily:
+            day = datetime.now().date().isoformat()
+            requests.append(UpdateOne({"_id": daily_counters_id(day)}, {"$inc": daily, "$set": {"day": day}},
+                                      upsert=True))
+        if not requests:
+            return
+        try:
+            await self.counters.bulk_write(requests, ordered=False)
+        except Exception as e:
+            logger.error(f"_record_counters: Failed to update counters {totals}, {daily}: {e}")
+
+    async def _record_operation_counters(self, results: List[dict]):
+        added = sum(1 for result in results if result["ok"] and result["op"] == "add")
+        bought = sum(1 for result in results if result["ok"] and result["op"] == "toggle" and result["item"]["bought"])
+        increments = {key: value for key, value in (("items_added", added), ("items_bought", bought)) if value}
+        if increments:
+            await self._record_counters(increments, increments)
+
+    async def get_admin_stats(self, days: int) -> dict:
+        today = datetime.now().date()
+        dates = [(today - timedelta(days=offset)).isoformat() for offset in range(days)]
+        documents = {document["_id"]: document async for document in self.counters.find(
+            {"_id": {"$in": [COUNTERS_TOTALS_ID] + [daily_counters_id(day) for day in dates]}})}
+        totals = documents.get(COUNTERS_TOTALS_ID, {})
+        return {"totals": {key: totals.get(key, 0) for key in TOTAL_COUNTERS},
+                "days": [{"day": day, **{key: documents.get(daily_counters_id(day), {}).get(key, 0)
+                                         for key in DAILY_COUNTERS}} for day in dates]}
+
+    async def rebuild_counters(self):
+        """Recomputes the all-time counters from the collections; daily counters cannot be restored."""
+        totals = {"users": await self.users.count_documents({}),
+                  "open_lists": await self.lists.count_documents({"completed": {"$ne": True}})}
+        await self.counters.update_one({"_id": COUNTERS_TOTALS_ID}, {"$set": totals}, upsert=True)
+        logger.info(f"rebuild_counters: Totals set to {totals}")
+        return totals
+
+    async def export_documents(self, collection, batch_size: int, after: Optional[str] = None):
+        """Yields the documents of a collection in _id order, one cursor batch at a time."""
+        query = {"_id": {"$gt": ObjectId(after)}} if after else {}
+        batch = []
+        async for document in collection.find(query).sort("_id", ASCENDING).batch_size(batch_size):
+            document["_id"] = str(document["_id"])
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def export_lists(self, batch_size: int, after: Optional[str] = None):
+        async for batch in self.export_documents(self.lists, batch_size, after):
+            await self._attach_items([list_data for list_data in batch if uses_items_collection(list_data)])
+            yield [public_list(list_data) for list_data in batch]
+
+    async def export_users(self, batch_size: int, after: Optional[str] = None):
+        async for batch in self.export_documents(self.users, batch_size, after):
+            yield batch
+
+    async def acquire_job_lease(self, name: str, owner: str, lease_seconds: float) -> bool:
+        now = datetime.utcnow()
+        try:
+            job = await self.jobs.find_one_and_update(
+                {"_id": name, "locked_until": {"$lte": now}},
+                {"$set": {"owner": owner, "locked_until": now + timedelta(seconds=lease_seconds), "started_at": now}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            logger.debug(f"acquire_job_lease: Job {name} is locked by another worker")
+            return False
+        logger.debug(f"acquire_job_lease: Job {name} acquired by {owner}")
+        return job is not None
+
+    async def renew_job_lease(self, name: str, owner: str, lease_seconds: float) -> bool:
+        result = await self.jobs.update_one(
+            {"_id": name, "owner": owner},
+            {"$set": {"locked_until": datetime.utcnow() + timedelta(seconds=lease_seconds)}})
+        return result.matched_count == 1
+
+    async def finish_job(self, name: str, owner: str, next_run_at: datetime, result: dict):
+        await self.jobs.update_one({"_id": name, "owner": owner},
+                                   {"$set": {"locked_until": next_run_at, "finished_at": datetime.utcnow(),
+                                             "last_result": result}})
+        logger.debug(f"finish_job: Job {name} finished by {owner}, next run at {next_run_at}")
+
+    async def get_job(self, name: str) -> Optional[dict]:
+        return await self.jobs.find_one({"_id": name})
+
+    async def compact_utils_batch(self, after_id: Optional[ObjectId], batch_size: int) -> Optional[dict]:
+        """Removes per-list entries of utils documents whose list no longer exists.
+
+        Scans one batch of utils documents in _id order and returns the batch statistics,
+        or None when there is nothing left to scan. Reclaimed bytes are measured as the
+        difference in BSON size of the affected fields.
+        """
+        query = {"_id": {"$gt": after_id}} if after_id is not None else {}
+        projection = {field: 1 for field in UTILS_LIST_FIELDS}
+        docs = await self.utils.find(query, projection).sort("_id", ASCENDING).limit(batch_size).to_list(None)
+        if not docs:
+            return None
+
+        referenced = {list_id for doc in docs for field in UTILS_LIST_FIELDS
+                      if isinstance(doc.get(field), dict) for list_id in doc[field]}
+        object_ids = [ObjectId(list_id) for list_id in referenced if ObjectId.is_valid(list_id)]
+        existing = {str(list_data["_id"]) async for list_data in
+                    self.lists.find({"_id": {"$in": object_ids}}, {"_id": 1})}
 
-        await self.lists.update_one({"_id": ObjectId(list_id)}, {"$push": {"items": {"$each": items_to_insert}}})
-        logger.debug(f"add_shopping_items_bulk: {len(items_to_insert)} items added to list_id={list_id}")
-        return item_names
+        requests = []
+        entries_removed = 0
+        bytes_reclaimed = 0
+        for doc in docs:
+            orphans = [(field, list_id) for field in UTILS_LIST_FIELDS if isinstance(doc.get(field), dict)
+                       for list_id in doc[field] if list_id not in existing]
+            if not orphans:
+                continue
+            size_before = len(bson.encode(doc))
+            for field, list_id in orphans:
+                del doc[field][list_id]
+            bytes_reclaimed += size_before - len(bson.encode(doc))
+            entries_removed += len(orphans)
+            requests.append(UpdateOne({"_id": doc["_id"]},
+                                      {"$unset": {f"{field}.{list_id}": "" for field, list_id in orphans}}))
+        if requests:
+            await self.utils.bulk_write(requests, ordered=False)
+        logger.debug(f"compact_utils_batch: Scanned {len(docs)} documents, removed {entries_removed} entries "
+                     f"from {len(requests)} documents, reclaimed {bytes_reclaimed} bytes")
+        return {"last_id": docs[-1]["_id"], "scanned": len(docs), "updated": len(requests),
+                "entries_removed": entries_removed, "bytes_reclaimed": bytes_reclaimed}
@@ -0,0 +1,32 @@
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import HOST, PORT, WORKERS, GRACEFUL_TIMEOUT
+
+# Must be set before the workers import prometheus_client so that their metrics are written to shared files
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+bind = f"{HOST}:{PORT}"
+workers = WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = GRACEFUL_TIMEOUT
+timeout = GRACEFUL_TIMEOUT * 2
+keepalive = 5
+# Each worker opens its own MongoDB client in the lifespan; the app must not be imported before fork
+preload_app = False
+
+
+def on_starting(server):
+    multiproc_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+    server.log.info(f"Starting {workers} workers, Prometheus multiprocess dir {multiproc_dir}")
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,34 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
+
+from fastapi import FastAPI
+
+from compaction import run_utils_compaction
+from config import ITEMS_STORAGE, UTILS_COMPACTION_INTERVAL
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database = Database()
+    try:
+        await database.ping()
+        logger.info("lifespan: MongoDB connection established")
+        await database.ensure_indexes()
+        await database.init_items_storage(ITEMS_STORAGE)
+    except Exception as e:
+        logger.error(f"lifespan: MongoDB ping failed on startup: {e}")
+    app.state.db = database
+    compaction_task = asyncio.create_task(run_utils_compaction(database)) if UTILS_COMPACTION_INTERVAL > 0 else None
+    try:
+        yield
+    finally:
+        if compaction_task is not None:
+            compaction_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await compaction_task
+        database.close()
+        logger.info("lifespan: MongoDB connection closed")
@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+from bson.objectid import ObjectId
+
+from config import MONGODB_DATABASE
+from database import Database, new_item
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()])
+logger = logging.getLogger(__name__)
+
+FIRST_USER_ID = 9_000_000_000
+DEFAULT_MIX = "render=70,toggle=20,bulk_add=8,complete=2"
+
+
+async def seed(args) -> dict:
+    if MONGODB_DATABASE == "shopping_bot" and not args.force:
+        raise SystemExit("Refusing to seed the default database; set MONGODB_DATABASE or pass --force.")
+    rng = random.Random(args.seed)
+    database = Database()
+    try:
+        await database.ensure_indexes()
+        user_ids = [FIRST_USER_ID + index for index in range(args.users)]
+        old_list_ids = [str(list_data["_id"]) async for list_data in
+                        database.lists.find({"owner_id": {"$gte": FIRST_USER_ID}}, {"_id": 1})]
+        await database.items.delete_many({"list_id": {"$in": old_list_ids}})
+        await database.users.delete_many({"user_id": {"$gte": FIRST_USER_ID}})
+        await database.utils.delete_many({"user_id": {"$gte": FIRST_USER_ID}})
+        await database.lists.delete_many({"owner_id": {"$gte": FIRST_USER_ID}})
+        # Counters are not kept per user, so they are only reset in a dedicated database
+        if MONGODB_DATABASE != "shopping_bot":
+            await database.counters.delete_many({})
+        else:
+            logger.warning("Counters of earlier runs are kept in the default database")
+
+        lists = []
+        list_ids_by_user = defaultdict(list)
+        for index in range(args.lists):
+            owner_id = user_ids[index % len(user_ids)]
+            members = [owner_id] + rng.sample([uid for uid in user_ids if uid != owner_id],
+                                              min(args.members - 1, len(user_ids) - 1))
+            items = [new_item(f"Товар {index}-{position}") for position in range(args.items)]
+            for item in items:
+                item["bought"] = rng.random() < 0.3
+            list_id = ObjectId()
+            lists.append({"_id": list_id, "owner_id": owner_id, "users": members, "items": items, "completed": False,
+                          "last_notification_text": None, "version": 1})
+            for member in members:
+                list_ids_by_user[member].append(str(list_id))
+
+        for start in range(0, len(lists), 500):
+            await database.lists.insert_many(lists[start:start + 500])
+        await database.users.insert_many([
+            {"user_id": user_id, "chat_id": user_id, "username": f"loadtest_{user_id}", "last_actions": [],
+             "list_ids": list_ids_by_user[user_id]} for user_id in user_ids])
+        await database.utils.insert_many([
+            {"user_id": user_id, "current_pages": {}, "skip_confirm": {}, "last_list_messages": {}} for user_id in
+            user_ids])
+
+        manifest = {"database": MONGODB_DATABASE, "lists": [
+            {"list_id": str(list_data["_id"]), "owner_id": list_data["owner_id"], "users": list_data["users"],
+             "item_ids": [item["item_id"] for item in list_data["items"]]} for list_data in lists]}
+        with open(args.manifest, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        logger.info(f"Seeded {len(user_ids)} users and {len(lists)} lists into {MONGODB_DATABASE}, "
+                    f"manifest written to {args.manifest}")
+        return manifest
+    finally:
+        database.close()
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios in mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+class LoadRunner:
+    def __init__(self, client: httpx.AsyncClient, lists: list, rng: random.Random):
+        self.client = client
+        self.lists = lists
+        self.rng = rng
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.expected_not_found = defaultdict(int)
+        self.completed_list_ids = set()
+
+    async def timed(self, name: str, method: str, url: str, list_id: str = None, **kwargs) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+        except httpx.HTTPError as e:
+            # A list completed by the complete scenario is gone by design, so its 404s are not errors
+            if (isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 404
+                    and list_id in self.completed_list_ids):
+                self.expected_not_found[name] += 1
+            else:
+                self.errors[name] += 1
+            logger.debug(f"{name}: {method} {url} failed: {e}")
+            return None
+        finally:
+            self.latencies[name].append(time.perf_counter() - start)
+
+    async def render(self, state: dict):
+        user_id = self.rng.choice(state["users"])
+        await self.timed("render", "GET", f"/views/{user_id}/lists/{state['list_id']}/", state["list_id"],
+                         params={"page": self.rng.randint(1, 3)})
+
+    async def toggle(self, state: dict):
+        if not state["item_ids"]:
+            return await self.bulk_add(state)
+        item_id = self.rng.choice(state["item_ids"])
+        await self.timed("toggle", "PUT", f"/lists/{state['list_id']}/items/{item_id}/toggle/", state["list_id"])
+
+    async def bulk_add(self, state: dict):
+        names = [f"Новый товар {self.rng.randint(0, 10 ** 6)}" for _ in range(self.rng.randint(1, 5))]
+        list_id = state["list_id"]
+        response = await self.timed("bulk_add", "POST", f"/lists/{list_id}/items/bulk/", list_id,
+                                    params={"return_list": "true"},
+                                    json={"items": [{"item_name": name} for name in names]})
+        if response is not None and state["list_id"] == list_id:
+            list_data = response.json().get("list") or {}
+            state["item_ids"] = [item["item_id"] for item in list_data.get("items", [])]
+
+    async def complete(self, state: dict):
+        list_id = state["list_id"]
+        already_completed = list_id in self.completed_list_ids
+        self.completed_list_ids.add(list_id)
+        response = await self.timed("complete", "POST", f"/lists/{list_id}/complete/",
+                                    list_id if already_completed else None)
+        if response is None:
+            return
+        response = await self.timed("create_list", "POST", "/lists/", params={"user_id": state["owner_id"]})
+        if response is None:
+            return
+        state["list_id"] = response.json()["list_id"]
+        state["users"] = [state["owner_id"]]
+        state["item_ids"] = []
+
+    async def worker(self, lists: list, deadline: float, scenarios: list, weights: list):
+        while time.perf_counter() < deadline:
+            state = self.rng.choice(lists)
+            scenario = self.rng.choices(scenarios, weights)[0]
+            await SCENARIOS[scenario](self, state)
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[name] = {"requests": len(values), "errors": self.errors[name],
+                               "expected_not_found": self.expected_not_found[name],
+                               "throughput_rps": round(len(values) / duration, 2),
+                               "p50_ms": round(percentile(values, 50) * 1000, 2),
+                               "p95_ms": round(percentile(values, 95) * 1000, 2),
+                               "p99_ms": round(percentile(values, 99) * 1000, 2),
+                               "max_ms": round(values[-1] * 1000, 2)}
+        total = sum(len(values) for values in self.latencies.values())
+        return {"duration_s": round(duration, 2), "total_requests": total,
+                "throughput_rps": round(total / duration, 2), "endpoints": endpoints}
+
+
+SCENARIOS = {"render": LoadRunner.render, "toggle": LoadRunner.toggle, "bulk_add": LoadRunner.bulk_add,
+             "complete": LoadRunner.complete}
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run(args) -> dict:
+    with open(args.manifest) as manifest_file:
+        manifest = json.load(manifest_file)
+    weights = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    lists = [dict(list_state) for list_state in manifest["lists"]]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        runner = LoadRunner(client, lists, rng)
+        # Every worker drives its own lists, so completing a list never races with another worker using it
+        worker_lists = [lists[index::args.concurrency] or [lists[index % len(lists)]]
+                        for index in range(args.concurrency)]
+        if len(lists) < args.concurrency:
+            logger.warning(f"Only {len(lists)} lists for {args.concurrency} workers, some lists are shared")
+        if args.warmup > 0:
+            await asyncio.gather(*(runner.worker(own_lists, time.perf_counter() + args.warmup, ["render"], [1])
+                                   for own_lists in worker_lists))
+            runner.latencies.clear()
+            runner.errors.clear()
+            runner.expected_not_found.clear()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(runner.worker(own_lists, deadline, list(weights), list(weights.values()))
+                               for own_lists in worker_lists))
+        report = runner.report(time.perf_counter() - start)
+    report.update({"url": args.url, "concurrency": args.concurrency, "mix": weights})
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    logger.info(f"Load test finished: {report['total_requests']} requests, {report['throughput_rps']} rps, "
+                f"report written to {args.output}")
+    for name, stats in report["endpoints"].items():
+        logger.info(f"{name}: p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms "
+                    f"rps={stats['throughput_rps']} errors={stats['errors']} "
+                    f"expected_not_found={stats['expected_not_found']}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed synthetic data and load test the shopping list API.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser("seed", help="Seed MONGODB_DATABASE with synthetic users and lists")
+    seed_parser.add_argument("--users", type=int, default=1000)
+    seed_parser.add_argument("--lists", type=int, default=500)
+    seed_parser.add_argument("--members", type=int, default=3, help="Members per list, including the owner")
+    seed_parser.add_argument("--items", type=int, default=50, help="Items per list")
+    seed_parser.add_argument("--manifest", default="loadtest_manifest.json")
+    seed_parser.add_argument("--seed", type=int, default=42)
+    seed_parser.add_argument("--force", action="store_true", help="Allow seeding the default shopping_bot database")
+
+    run_parser = subparsers.add_parser("run", help="Drive the API with a scenario mix and report latencies")
+    run_parser.add_argument("--url", default="http://127.0.0.1:8001")
+    run_parser.add_argument("--manifest", default="loadtest_manifest.json")
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--duration", type=float, default=30.0, help="Measured duration in seconds")
+    run_parser.add_argument("--warmup", type=float, default=3.0, help="Render-only warmup in seconds")
+    run_parser.add_argument("--mix", default=DEFAULT_MIX)
+    run_parser.add_argument("--output", default="loadtest_report.json")
+    run_parser.add_argument("--seed", type=int, default=42)
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        asyncio.run(seed(args))
+    else:
+        report = asyncio.run(run(args))
+        if any(stats["errors"] for stats in report["endpoints"].values()):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
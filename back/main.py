@@ -2,15 +2,20 @@ import logging
 
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from config import HOST, PORT
+from lifespan import lifespan
+from metrics import metrics_middleware
 from routes import router
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[logging.StreamHandler()])
 
-app = FastAPI(title="Shopping List API", description="API для управления списками покупок", version="1.0.0")
+app = FastAPI(title="Shopping List API", description="API для управления списками покупок", version="1.0.0",
+              lifespan=lifespan, default_response_class=ORJSONResponse)
 
+app.middleware("http")(metrics_middleware)
 app.include_router(router)
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+import logging
+import os
+import time
+
+from fastapi import Request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route template",
+                            ["method", "route", "status"])
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being processed",
+                           multiprocess_mode="livesum")
+MONGO_COMMAND_LATENCY = Histogram("mongodb_command_duration_seconds", "MongoDB command latency",
+                                  ["collection", "command"])
+MONGO_COMMAND_FAILURES = Counter("mongodb_command_failures_total", "Failed MongoDB commands",
+                                 ["collection", "command"])
+LIST_CACHE_EVENTS = Counter("list_cache_events_total", "List cache lookups and maintenance events", ["event"])
+READ_COALESCING_EVENTS = Counter("read_coalescing_events_total",
+                                 "Reads that started a query (leaders) or joined one in flight (collapsed)",
+                                 ["query", "event"])
+UTILS_COMPACTION_ENTRIES = Counter("utils_compaction_entries_removed_total",
+                                   "Per-list utils entries removed for deleted lists")
+UTILS_COMPACTION_BYTES = Counter("utils_compaction_bytes_reclaimed_total",
+                                 "BSON bytes removed from utils documents by compaction")
+
+
+def render_metrics() -> bytes:
+    """Metrics of this process, or the sum over all workers when running under gunicorn."""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+async def metrics_middleware(request: Request, call_next):
+    start = time.perf_counter()
+    status = "500"
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        REQUEST_LATENCY.labels(request.method, route_path, status).observe(time.perf_counter() - start)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self.collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")
+        self.collections[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(collection, event.command_name).inc()
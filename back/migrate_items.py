@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+from database import Database, ITEMS_COLLECTION, ITEMS_EMBEDDED
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()])
+logger = logging.getLogger(__name__)
+
+
+async def migrate_items(storage: str, batch_size: int, dry_run: bool = False) -> bool:
+    database = Database()
+    try:
+        await database.ensure_indexes()
+        if storage == ITEMS_COLLECTION:
+            query = {"items_storage": {"$ne": ITEMS_COLLECTION}}
+        else:
+            query = {"items_storage": ITEMS_COLLECTION}
+        pending = await database.lists.count_documents(query)
+        logger.info(f"{pending} lists to move to {storage} storage")
+        if dry_run:
+            return True
+        # Switch the target first, so that no worker moves a list back while the rest are migrated
+        await database.set_items_storage(storage)
+        if not pending:
+            return True
+
+        migrated = failed = 0
+        after_id = None
+        while True:
+            batch_query = {**query, "_id": {"$gt": after_id}} if after_id is not None else query
+            batch = await database.lists.find(batch_query, {"_id": 1}).sort("_id", 1).limit(batch_size).to_list(None)
+            if not batch:
+                break
+            after_id = batch[-1]["_id"]
+            for list_data in batch:
+                # The batch is only a list of ids: every list is migrated from its current state
+                if await database.ensure_list_storage(str(list_data["_id"]), storage):
+                    migrated += 1
+                elif await database.lists.count_documents({"_id": list_data["_id"]}, limit=1):
+                    failed += 1
+                    logger.error(f"List {list_data['_id']} could not be moved to {storage} storage")
+            logger.info(f"Moved {migrated} of {pending} lists")
+        logger.info(f"Migration to {storage} storage finished: {migrated} moved, {failed} failed")
+        return failed == 0
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move list items between embedded and collection storage.")
+    parser.add_argument("--to", dest="storage", choices=[ITEMS_COLLECTION, ITEMS_EMBEDDED], required=True)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true", help="Only count the lists that would be moved")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(migrate_items(args.storage, args.batch_size, args.dry_run)) else 1)
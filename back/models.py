@@ -1,12 +1,12 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Literal, Optional
 
 from pydantic import BaseModel
 
 
 class UserActionRequest(BaseModel):
     user_id: int
-    chat_id: int
-    username: str
+    chat_id: Optional[int] = None
+    username: Optional[str] = None
 
 
 class UserResponse(BaseModel):
@@ -29,6 +29,14 @@ class UserListsResponse(BaseModel):
 
 class ListItemsResponse(BaseModel):
     items: Dict[str, Dict]
+    page: Optional[int] = None
+    page_size: Optional[int] = None
+    total: Optional[int] = None
+    bought: Optional[int] = None
+    total_pages: Optional[int] = None
+
+
+ItemSort = Literal["insertion", "name"]
 
 
 class AddItemRequest(BaseModel):
@@ -84,5 +92,17 @@ class AddItemsRequest(BaseModel):
     items: List[AddItemRequest]
 
 
+class ListOperation(BaseModel):
+    op: Literal["add", "toggle", "delete", "rename"]
+    item_id: Optional[str] = None
+    name: Optional[str] = None
+
+
+class ListOperationsRequest(BaseModel):
+    ops: List[ListOperation]
+    user_id: Optional[int] = None
+
+
 class AddBulkItemsResponse(BaseModel):
     added_items: List[str]
+    list: Optional[Dict] = None
@@ -0,0 +1,21 @@
+import asyncio
+import logging
+
+from database import Database
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()])
+logger = logging.getLogger(__name__)
+
+
+async def rebuild_counters():
+    database = Database()
+    try:
+        totals = await database.rebuild_counters()
+        logger.info(f"Counters rebuilt: {totals}")
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(rebuild_counters())
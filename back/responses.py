@@ -0,0 +1,45 @@
+from typing import Any, AsyncIterator, List, Optional
+
+import orjson
+from fastapi import Request
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+
+def accepts_msgpack(request: Request) -> bool:
+    return msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def representation_etag(request: Request, etag: str) -> str:
+    return f'{etag[:-1]}-msgpack"' if accepts_msgpack(request) else etag
+
+
+async def ndjson_chunks(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield b"".join(orjson.dumps(document, default=str, option=orjson.OPT_APPEND_NEWLINE) for document in batch)
+
+
+def ndjson_response(batches: AsyncIterator[List[dict]], filename: str) -> StreamingResponse:
+    return StreamingResponse(ndjson_chunks(batches), media_type=NDJSON_MEDIA_TYPE,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+def negotiated_response(request: Request, content: Any, headers: Optional[dict] = None) -> Response:
+    headers = {**(headers or {}), "Vary": "Accept"}
+    if accepts_msgpack(request):
+        return MsgPackResponse(content, headers=headers)
+    return ORJSONResponse(content, headers=headers)
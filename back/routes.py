@@ -1,22 +1,50 @@
 import logging
-from typing import Union
-
-from fastapi import APIRouter, Depends, HTTPException
-
-from database import Database
+import os
+import secrets
+from typing import Optional, Union
+
+from bson.objectid import ObjectId
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from compaction import UTILS_COMPACTION_JOB
+from config import WORKERS, ADMIN_TOKEN, EXPORT_BATCH_SIZE
+from database import (Database, ListVersionConflict, format_list_items, list_etag, paginate_items, public_item,
+                      public_list, public_operation_results)
+from metrics import render_metrics
 from models import *
+from responses import ndjson_response, negotiated_response, representation_etag
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+LIST_SUMMARY_PROJECTION = {"items": 0, "last_notification_text": 0}
+
+
+def get_database(request: Request) -> Database:
+    return request.app.state.db
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def validate_export_cursor(after: Optional[str] = None) -> Optional[str]:
+    if after is not None and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="after must be a document _id")
+    return after
 
-def get_database():
-    database = Database()
-    try:
-        yield database
-    finally:
-        database.client.close()
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
 
 
 @router.get("/health")
@@ -24,12 +52,61 @@ async def health_check():
     return {"status": "ok"}
 
 
+@router.get("/ready")
+async def readiness_check(db: Database = Depends(get_database)):
+    try:
+        await db.ping()
+    except Exception as e:
+        logger.error(f"readiness_check: MongoDB is unavailable: {e}")
+        raise HTTPException(status_code=503, detail="MongoDB is unavailable")
+    return {"status": "ready", "pid": os.getpid()}
+
+
+@router.get("/metrics")
+async def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+@router.get("/stats/cache", dependencies=[Depends(require_admin)])
+async def cache_stats(db: Database = Depends(get_database)):
+    return {"pid": os.getpid(), "workers": WORKERS, "lists": db.list_cache.stats(),
+            "coalesced_reads": {"lists": db.list_reads.stats(), "users": db.user_reads.stats()}}
+
+
+@router.get("/stats/compaction", dependencies=[Depends(require_admin)])
+async def compaction_stats(db: Database = Depends(get_database)):
+    job = await db.get_job(UTILS_COMPACTION_JOB)
+    return {"utils": job}
+
+
+@router.get("/stats/admin", dependencies=[Depends(require_admin)])
+async def admin_stats(days: int = Query(7, ge=1, le=90), db: Database = Depends(get_database)):
+    logger.debug(f"admin_stats: days={days}")
+    return await db.get_admin_stats(days)
+
+
+@router.get("/export/lists.ndjson", dependencies=[Depends(require_admin)])
+async def export_lists(after: Optional[str] = Depends(validate_export_cursor),
+                       batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=10000),
+                       db: Database = Depends(get_database)):
+    logger.debug(f"export_lists: after={after}, batch_size={batch_size}")
+    return ndjson_response(db.export_lists(batch_size, after), "lists.ndjson")
+
+
+@router.get("/export/users.ndjson", dependencies=[Depends(require_admin)])
+async def export_users(after: Optional[str] = Depends(validate_export_cursor),
+                       batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=10000),
+                       db: Database = Depends(get_database)):
+    logger.debug(f"export_users: after={after}, batch_size={batch_size}")
+    return ndjson_response(db.export_users(batch_size, after), "users.ndjson")
+
+
 @router.get("/users/{user_id}/", response_model=Union[UserResponse, dict])
-async def get_user_endpoint(user_id: int, db: Database = Depends(get_database)):
+async def get_user_endpoint(user_id: int, request: Request, db: Database = Depends(get_database)):
     logger.debug(f"get_user_endpoint: user_id={user_id}")
     user_data = await db.get_user(user_id)
     if user_data:
-        return user_data
+        return negotiated_response(request, user_data)
     else:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -51,11 +128,25 @@ async def set_last_list_message_endpoint(user_id: int, list_id: str, request: Se
 
 
 @router.get("/lists/{list_id}/", response_model=ListResponse)
-async def get_list(list_id: str, db: Database = Depends(get_database)):
+async def get_list(list_id: str, request: Request, db: Database = Depends(get_database)):
     logger.debug(f"get_list_endpoint: list_id={list_id}")
     list_data = await db._get_list(list_id)
-    if list_data:
-        return list_data
+    if not list_data:
+        raise HTTPException(status_code=404, detail="List not found")
+    etag = representation_etag(request, list_etag(list_data))
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+    return negotiated_response(request, public_list(list_data), {"ETag": etag})
+
+
+@router.get("/views/{user_id}/lists/{list_id}/")
+async def get_list_view_endpoint(user_id: int, list_id: str, request: Request,
+                                 page: Optional[int] = Query(None, ge=1), page_size: int = Query(6, ge=1, le=100),
+                                 sort: ItemSort = "insertion", db: Database = Depends(get_database)):
+    logger.debug(f"get_list_view_endpoint: user_id={user_id}, list_id={list_id}, page={page}, sort={sort}")
+    view = await db.get_list_view(user_id, list_id, page, page_size, sort)
+    if view:
+        return negotiated_response(request, view)
     else:
         raise HTTPException(status_code=404, detail="List not found")
 
@@ -76,45 +167,75 @@ async def create_list(user_id: int, db: Database = Depends(get_database)):
 
 
 @router.get("/users/{user_id}/lists/", response_model=UserListsResponse)
-async def get_lists_for_user(user_id: int, db: Database = Depends(get_database)):
-    logger.debug(f"get_lists_for_user_endpoint: user_id={user_id}")
-    lists = await db.get_user_lists(user_id)
+async def get_lists_for_user(user_id: int, summary: bool = False, db: Database = Depends(get_database)):
+    logger.debug(f"get_lists_for_user_endpoint: user_id={user_id}, summary={summary}")
+    lists = await db.get_user_lists(user_id, LIST_SUMMARY_PROJECTION if summary else None)
     return {"lists": lists}
 
 
 @router.get("/lists/{list_id}/items/", response_model=ListItemsResponse)
-async def get_items_for_list(list_id: str, db: Database = Depends(get_database)):
-    logger.debug(f"get_items_for_list_endpoint: list_id={list_id}")
-    items = await db.get_list_items(list_id)
-    return {"items": items}
+async def get_items_for_list(list_id: str, request: Request,
+                             page: Optional[int] = Query(None, ge=1), page_size: int = Query(6, ge=1, le=100),
+                             sort: ItemSort = "insertion", db: Database = Depends(get_database)):
+    logger.debug(f"get_items_for_list_endpoint: list_id={list_id}, page={page}, sort={sort}")
+    list_data = await db._get_list(list_id)
+    if not list_data:
+        return negotiated_response(request, {"items": {}})
+    etag = representation_etag(request, list_etag(list_data))
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+    if page is None and sort == "insertion":
+        content = {"items": format_list_items(list_data.get("items", []))}
+    else:
+        items, bought = db.get_sorted_items(list_data, sort)
+        if page is None:
+            content = {"items": format_list_items(items)}
+        else:
+            items_page = paginate_items(items, bought, page, page_size)
+            content = {**items_page, "items": format_list_items(items_page["items"])}
+    return negotiated_response(request, content, {"ETag": etag})
 
 
 @router.post("/lists/{list_id}/items/")
-async def add_item_to_list(list_id: str, request: AddItemRequest, db: Database = Depends(get_database)):
+async def add_item_to_list(list_id: str, request: AddItemRequest, return_list: bool = False,
+                           db: Database = Depends(get_database)):
     logger.debug(f"add_item_to_list_endpoint: list_id={list_id}, item_name={request.item_name}")
-    item_id = await db.add_shopping_item(list_id, request.item_name)
-    return {"item_id": item_id, "status": "item added"}
+    item_id, list_data = await db.add_shopping_item(list_id, request.item_name)
+    response = {"item_id": item_id, "status": "item added"}
+    if return_list:
+        response["list"] = public_list(list_data)
+    return response
 
 
 @router.put("/lists/{list_id}/items/{item_id}/toggle/")
-async def toggle_item_in_list(list_id: str, item_id: str, db: Database = Depends(get_database)):
+async def toggle_item_in_list(list_id: str, item_id: str, return_list: bool = False,
+                              db: Database = Depends(get_database)):
     logger.debug(f"toggle_item_in_list_endpoint: list_id={list_id}, item_id={item_id}")
-    await db.toggle_shopping_item(list_id, item_id)
-    return {"status": "item toggled"}
+    item, list_data = await db.toggle_shopping_item(list_id, item_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    response = {"status": "item toggled", "item": public_item(item)}
+    if return_list:
+        response["list"] = public_list(list_data)
+    return response
 
 
 @router.delete("/lists/{list_id}/items/{item_id}/")
-async def delete_item_from_list(list_id: str, item_id: str, db: Database = Depends(get_database)):
+async def delete_item_from_list(list_id: str, item_id: str, return_list: bool = False,
+                                db: Database = Depends(get_database)):
     logger.debug(f"delete_item_from_list_endpoint: list_id={list_id}, item_id={item_id}")
-    await db.delete_shopping_item(list_id, item_id)
-    return {"status": "item deleted"}
+    list_data = await db.delete_shopping_item(list_id, item_id)
+    response = {"status": "item deleted"}
+    if return_list:
+        response["list"] = public_list(list_data)
+    return response
 
 
 @router.post("/lists/{list_id}/complete/")
 async def complete_shopping_list(list_id: str, db: Database = Depends(get_database)):
     logger.debug(f"complete_shopping_list_endpoint: list_id={list_id}")
     users, items, last_message_ids_for_users = await db.complete_list(list_id)
-    return {"status": "list completed", "users": users, "items": items,
+    return {"status": "list completed", "users": users, "items": [public_item(item) for item in items],
             "last_message_ids_for_users": last_message_ids_for_users}
 
 
@@ -240,8 +361,30 @@ async def clear_user_last_subscribed_list(user_id: int, db: Database = Depends(g
 
 
 @router.post("/lists/{list_id}/items/bulk/", response_model=AddBulkItemsResponse)
-async def add_bulk_items_to_list(list_id: str, request: AddItemsRequest, db: Database = Depends(get_database)):
+async def add_bulk_items_to_list(list_id: str, request: AddItemsRequest, return_list: bool = False,
+                                 db: Database = Depends(get_database)):
     logger.debug(f"add_bulk_items_to_list_endpoint: list_id={list_id}, items={request.items}")
     item_names = [item.item_name for item in request.items]
-    added_item_names = await db.add_shopping_items_bulk(list_id, item_names)
-    return {"added_items": added_item_names}
+    added_item_names, list_data = await db.add_shopping_items_bulk(list_id, item_names)
+    response = {"added_items": added_item_names}
+    if return_list:
+        response["list"] = public_list(list_data)
+    return response
+
+
+@router.post("/lists/{list_id}/ops/")
+async def apply_list_operations_endpoint(list_id: str, request: ListOperationsRequest, return_list: bool = False,
+                                         db: Database = Depends(get_database)):
+    logger.debug(f"apply_list_operations_endpoint: list_id={list_id}, ops={request.ops}, user_id={request.user_id}")
+    try:
+        results, list_data = await db.apply_list_operations(list_id, [op.model_dump() for op in request.ops],
+                                                            request.user_id)
+    except ListVersionConflict:
+        raise HTTPException(status_code=409, detail="List was modified concurrently, retry the operations.")
+    if list_data is None:
+        raise HTTPException(status_code=404, detail="List not found")
+    response = {"status": "operations applied", "results": public_operation_results(results),
+                "version": list_data.get("version")}
+    if return_list:
+        response["list"] = public_list(list_data)
+    return response
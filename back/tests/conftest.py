@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+from bson.objectid import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as database_module  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def database(monkeypatch):
+    monkeypatch.setattr(database_module, "AsyncIOMotorClient", lambda *args, **kwargs: AsyncMongoMockClient())
+    return database_module.Database()
+
+
+@pytest.fixture
+def create_list(database):
+    async def create(item_names=(), owner_id=1):
+        list_id = ObjectId()
+        items = [database_module.new_item(name) for name in item_names]
+        await database.lists.insert_one({"_id": list_id, "owner_id": owner_id, "users": [owner_id], "items": items,
+                                         "version": 0})
+        return str(list_id), items
+    return create
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from cache import ListCache, SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+def test_read_started_before_invalidation_is_not_cached():
+    cache = ListCache(10, 60)
+    cache.put("a", {"version": 1})
+    read_generation = cache.begin_read()
+    cache.invalidate("a")
+    cache.put("a", {"version": 1}, read_generation)
+    assert cache.get("a") is None
+    assert cache.stale_rejections == 1
+
+    cache.put("a", {"version": 2}, cache.begin_read())
+    assert cache.get("a") == {"version": 2}
+
+
+def test_read_started_before_evicted_invalidation_is_not_cached():
+    cache = ListCache(1, 60)
+    read_generation = cache.begin_read()
+    cache.invalidate("a")
+    cache.put("b", {"version": 1})
+    assert "a" not in cache.entries
+    cache.put("a", {"version": 1}, read_generation)
+    assert cache.get("a") is None
+
+
+def test_older_write_result_does_not_replace_newer_one():
+    cache = ListCache(10, 60)
+    cache.refresh("a", {"version": 6})
+    cache.refresh("a", {"version": 5})
+    assert cache.get("a") == {"version": 6}
+
+    cache.invalidate("a")
+    cache.put("a", {"version": 5}, cache.begin_read())
+    assert cache.get("a") is None
+
+
+async def test_single_flight_shares_result_and_survives_cancelled_caller():
+    flight = SingleFlight("test")
+    release = asyncio.Event()
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return {"version": 1}
+
+    first = asyncio.create_task(flight.do("a", load))
+    second = asyncio.create_task(flight.do("a", load))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+    assert await second == {"version": 1}
+    assert calls == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "collapsed": 1}
+
+
+@pytest.fixture
+def slow_list_reads(database, monkeypatch):
+    release = asyncio.Event()
+    calls = []
+    blocked = set()
+    find_list = database._find_list
+
+    async def slow_find_list(list_id):
+        calls.append(list_id)
+        if list_id in blocked:
+            await release.wait()
+        return await find_list(list_id)
+
+    monkeypatch.setattr(database, "_find_list", slow_find_list)
+    return release, calls, blocked
+
+
+async def test_unrelated_write_keeps_reads_coalesced(database, create_list, slow_list_reads):
+    release, calls, blocked = slow_list_reads
+    list_id, _ = await create_list(["milk"])
+    other_id, _ = await create_list(["bread"])
+    blocked.add(list_id)
+    readers = [asyncio.create_task(database._get_list(list_id)) for _ in range(3)]
+    await asyncio.sleep(0)
+    await database.add_shopping_item(other_id, "eggs")
+    readers += [asyncio.create_task(database._get_list(list_id)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*readers)
+    assert calls.count(list_id) == 1
+    assert all(result["_id"] == list_id for result in results)
+
+
+async def test_write_to_list_starts_new_read(database, create_list, slow_list_reads):
+    release, calls, blocked = slow_list_reads
+    list_id, _ = await create_list(["milk"])
+    blocked.add(list_id)
+    before = asyncio.create_task(database._get_list(list_id))
+    await asyncio.sleep(0)
+    database.list_cache.invalidate(list_id)
+    after = asyncio.create_task(database._get_list(list_id))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(before, after)
+    assert calls == [list_id, list_id]
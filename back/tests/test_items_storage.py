@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+from bson.objectid import ObjectId
+
+from database import ITEMS_COLLECTION, ITEMS_EMBEDDED, public_list
+
+pytestmark = pytest.mark.anyio
+
+
+async def stored_list(database, list_id):
+    return await database.lists.find_one({"_id": ObjectId(list_id)})
+
+
+async def test_claim_is_exclusive_and_released(database, create_list):
+    list_id, _ = await create_list(["milk", "bread"])
+    list_data = await stored_list(database, list_id)
+    claimed = await database._claim_migration(list_data, ITEMS_COLLECTION)
+    assert claimed["migrating"]["to"] == ITEMS_COLLECTION
+    assert claimed["version"] == 1
+    assert await database._claim_migration(list_data, ITEMS_COLLECTION) is None
+    assert not await database.migrate_list_items(claimed, ITEMS_COLLECTION)
+    assert await database.items.count_documents({"list_id": list_id}) == 0
+
+    await database._release_migration(list_id, claimed["migrating"]["owner"])
+    released = await stored_list(database, list_id)
+    assert "migrating" not in released
+    assert released["version"] == 2
+    assert await database.migrate_list_items(released, ITEMS_COLLECTION)
+
+
+async def test_move_to_collection_and_back(database, create_list):
+    list_id, items = await create_list(["milk", "bread"])
+    assert await database.ensure_list_storage(list_id, ITEMS_COLLECTION)
+    moved = await stored_list(database, list_id)
+    assert moved["items_storage"] == ITEMS_COLLECTION and "items" not in moved and "migrating" not in moved
+    assert [item["item_id"] for item in await database._load_items(list_id)] == [item["item_id"] for item in items]
+
+    assert await database.ensure_list_storage(list_id, ITEMS_EMBEDDED)
+    moved_back = await stored_list(database, list_id)
+    assert "items_storage" not in moved_back and "migrating" not in moved_back
+    assert [item["item_id"] for item in moved_back["items"]] == [item["item_id"] for item in items]
+    assert await database.items.count_documents({"list_id": list_id}) == 0
+
+
+async def test_stale_snapshot_leaves_items_alone(database, create_list):
+    list_id, (item,) = await create_list(["milk"])
+    snapshot = await stored_list(database, list_id)
+    assert await database.ensure_list_storage(list_id, ITEMS_COLLECTION)
+    await database.set_items_storage(ITEMS_COLLECTION)
+    results, _ = await database.apply_list_operations(list_id, [{"op": "rename", "item_id": item["item_id"],
+                                                                 "name": "oat milk"}])
+    assert results[0]["ok"]
+
+    assert not await database.migrate_list_items(snapshot, ITEMS_COLLECTION)
+    assert [item["name"] for item in await database._load_items(list_id)] == ["oat milk"]
+
+
+async def test_writes_wait_for_claim(database, create_list):
+    list_id, _ = await create_list(["milk"])
+    claimed = await database._claim_migration(await stored_list(database, list_id), ITEMS_COLLECTION)
+    add = asyncio.create_task(database.add_shopping_item(list_id, "bread"))
+    await asyncio.sleep(0.2)
+    assert not add.done()
+    assert len((await stored_list(database, list_id))["items"]) == 1
+
+    await database._release_migration(list_id, claimed["migrating"]["owner"])
+    _, list_data = await add
+    assert [item["name"] for item in list_data["items"]] == ["milk", "bread"]
+
+
+async def test_collection_list_is_not_moved_back_implicitly(database, create_list):
+    list_id, _ = await create_list(["milk"])
+    assert await database.ensure_list_storage(list_id, ITEMS_COLLECTION)
+    assert await database.get_items_storage() == ITEMS_EMBEDDED
+
+    _, list_data = await database.add_shopping_item(list_id, "bread")
+    assert list_data["items_storage"] == ITEMS_COLLECTION
+    assert [item["name"] for item in await database._load_items(list_id)] == ["milk", "bread"]
+
+
+async def test_persisted_target_wins_over_worker_setting(database):
+    assert await database.init_items_storage(ITEMS_COLLECTION) == ITEMS_COLLECTION
+    assert await database.init_items_storage(ITEMS_EMBEDDED) == ITEMS_COLLECTION
+
+
+async def test_add_racing_with_move_to_embedded_is_retried(database, create_list, monkeypatch):
+    list_id, _ = await create_list(["milk"])
+    await database.set_items_storage(ITEMS_COLLECTION)
+    assert await database.ensure_list_storage(list_id, ITEMS_COLLECTION)
+    reserve_positions = database._reserve_positions
+
+    async def reserve_then_move(list_id, count):
+        position = await reserve_positions(list_id, count)
+        await database.set_items_storage(ITEMS_EMBEDDED)
+        assert await database.ensure_list_storage(list_id, ITEMS_EMBEDDED)
+        return position
+
+    monkeypatch.setattr(database, "_reserve_positions", reserve_then_move)
+    _, list_data = await database.add_shopping_items_bulk(list_id, ["bread", "eggs"])
+    assert [item["name"] for item in list_data["items"]] == ["milk", "bread", "eggs"]
+    assert "items_storage" not in await stored_list(database, list_id)
+    assert await database.items.count_documents({"list_id": list_id}) == 0
+
+
+
+async def test_public_list_hides_storage_fields(database, create_list):
+    list_id, _ = await create_list(["milk"])
+    await database.set_items_storage(ITEMS_COLLECTION)
+    await database.add_shopping_item(list_id, "bread")
+    await database.lists.update_one({"_id": ObjectId(list_id)}, {"$set": {"migrating": {"owner": "x", "to": "y"}}})
+    database.list_cache.invalidate(list_id)
+
+    list_data = public_list(await database._get_list(list_id))
+    for field in ("items_storage", "next_position", "migrating"):
+        assert field not in list_data
+    assert [sorted(item) for item in list_data["items"]] == [["bought", "item_id", "name"]] * 2
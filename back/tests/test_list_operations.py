@@ -0,0 +1,36 @@
+import pytest
+
+from database import apply_item_operations, new_item
+
+pytestmark = pytest.mark.anyio
+
+
+def test_apply_item_operations_keeps_per_operation_state():
+    item = new_item("milk")
+    items, results = apply_item_operations([item], [{"op": "toggle", "item_id": item["item_id"]},
+                                                    {"op": "toggle", "item_id": item["item_id"]}])
+    assert [result["item"]["bought"] for result in results] == [True, False]
+    assert items[0]["bought"] is False
+    assert item["bought"] is False
+
+
+def test_apply_item_operations_reports_deleted_and_renamed_items():
+    item = new_item("milk")
+    items, results = apply_item_operations([item], [{"op": "rename", "item_id": item["item_id"], "name": "Bread"},
+                                                    {"op": "delete", "item_id": item["item_id"]},
+                                                    {"op": "toggle", "item_id": item["item_id"]}])
+    assert items == []
+    assert results[0]["item"]["name"] == "Bread"
+    assert results[1]["ok"] and results[1]["item"]["name"] == "Bread"
+    assert results[2] == {"op": "toggle", "item_id": item["item_id"], "ok": False, "error": "item not found"}
+
+
+async def test_toggle_twice_in_one_batch(database, create_list):
+    list_id, (item,) = await create_list(["milk"])
+    results, list_data = await database.apply_list_operations(
+        list_id, [{"op": "toggle", "item_id": item["item_id"]}, {"op": "toggle", "item_id": item["item_id"]}])
+    assert [result["item"]["bought"] for result in results] == [True, False]
+    assert list_data["items"][0]["bought"] is False
+    assert list_data["version"] == 1
+    totals = await database.counters.find_one({"_id": "totals"})
+    assert totals["items_bought"] == 1
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import httpx
+import orjson
+
+from metrics import BACKEND_CALL_ERRORS, BACKEND_CALL_LATENCY, BACKEND_CALL_RETRIES, MetricsTransport
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+RETRY_STATUSES = {502, 503, 504}
+
+# Таймауты в секундах: быстрые чтения, обычные записи и тяжелые операции над целым списком
+READ_TIMEOUT = 5.0
+WRITE_TIMEOUT = 10.0
+HEAVY_TIMEOUT = 20.0
+STATS_TIMEOUT = 30.0
+
+
+def decode_response(response: httpx.Response):
+    if response.headers.get("content-type", "").startswith(MSGPACK_MEDIA_TYPE):
+        return msgpack.unpackb(response.content, raw=False)
+    return orjson.loads(response.content)
+
+
+class BackendClient:
+    """Клиент API бэкенда: по методу на эндпоинт.
+
+    Все методы возвращают разобранный ответ и бросают httpx.HTTPError при ошибке.
+    Идемпотентные вызовы повторяются до `max_retries` раз с экспоненциальной задержкой
+    и случайным разбросом при сетевых ошибках и ответах 502/503/504; остальные вызовы
+    повторяются, только если соединение не было установлено и запрос точно не дошел.
+    """
+
+    def __init__(self, base_url: str, use_msgpack: bool = False, etag_cache_size: int = 500,
+                 max_connections: int = 100, max_keepalive_connections: int = 20, keepalive_expiry: float = 30.0,
+                 http2: bool = False, max_retries: int = 2, retry_backoff: float = 0.1):
+        self.base_url = base_url.rstrip("/")
+        if use_msgpack and msgpack is None:
+            logger.warning("msgpack не установлен, используется JSON.")
+            use_msgpack = False
+        if http2 and h2 is None:
+            logger.warning("Пакет h2 не установлен, используется HTTP/1.1.")
+            http2 = False
+        headers = {"Accept": f"{MSGPACK_MEDIA_TYPE}, application/json"} if use_msgpack else {}
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                              keepalive_expiry=keepalive_expiry)
+        self.http_client = httpx.AsyncClient(
+            base_url=self.base_url, headers=headers, timeout=WRITE_TIMEOUT,
+            transport=MetricsTransport(httpx.AsyncHTTPTransport(limits=limits, http2=http2)))
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.etag_cache_size = etag_cache_size
+        self.etag_cache = OrderedDict()
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+    async def _request(self, name: str, method: str, path: str, timeout: float, idempotent: bool = False,
+                       **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    response = await self.http_client.request(method, path, timeout=timeout, **kwargs)
+                except httpx.TransportError as e:
+                    if attempt >= self.max_retries or not (idempotent or isinstance(e, httpx.ConnectError)):
+                        raise
+                    reason = type(e).__name__
+                else:
+                    if response.status_code not in RETRY_STATUSES or not idempotent or attempt >= self.max_retries:
+                        return response
+                    reason = str(response.status_code)
+                attempt += 1
+                BACKEND_CALL_RETRIES.labels(name, reason).inc()
+                delay = self.retry_backoff * 2 ** (attempt - 1)
+                await asyncio.sleep(random.uniform(delay / 2, delay * 1.5))
+        except httpx.HTTPError as e:
+            BACKEND_CALL_ERRORS.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            BACKEND_CALL_LATENCY.labels(name).observe(time.perf_counter() - start)
+
+    async def _call(self, name: str, method: str, path: str, timeout: float = WRITE_TIMEOUT,
+                    idempotent: bool = False, **kwargs):
+        response = await self._request(name, method, path, timeout, idempotent, **kwargs)
+        if response.is_error:
+            BACKEND_CALL_ERRORS.labels(name, str(response.status_code)).inc()
+        response.raise_for_status()
+        return decode_response(response)
+
+    async def _get_cached(self, name: str, path: str) -> dict:
+        cached = self.etag_cache.get(path)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response = await self._request(name, "GET", path, READ_TIMEOUT, idempotent=True, headers=headers)
+        if response.status_code == 304 and cached:
+            self.etag_cache.move_to_end(path)
+            return cached[1]
+        if response.is_error:
+            BACKEND_CALL_ERRORS.labels(name, str(response.status_code)).inc()
+        response.raise_for_status()
+        data = decode_response(response)
+        etag = response.headers.get("ETag")
+        if etag and self.etag_cache_size > 0:
+            self.etag_cache[path] = (etag, data)
+            self.etag_cache.move_to_end(path)
+            while len(self.etag_cache) > self.etag_cache_size:
+                self.etag_cache.popitem(last=False)
+        return data
+
+    async def get_list(self, list_id: str) -> dict:
+        return await self._get_cached("get_list", f"/lists/{list_id}/")
+
+    async def get_list_items(self, list_id: str) -> dict:
+        return (await self._get_cached("get_list_items", f"/lists/{list_id}/items/")).get("items", {})
+
+    async def get_list_view(self, user_id: int, list_id: str, page: Optional[int] = None,
+                            sort: str = "insertion") -> dict:
+        params = {"sort": sort}
+        if page is not None:
+            params["page"] = page
+        return await self._call("get_list_view", "GET", f"/views/{user_id}/lists/{list_id}/", READ_TIMEOUT,
+                                idempotent=True, params=params)
+
+    async def get_user(self, user_id: int) -> dict:
+        return await self._call("get_user", "GET", f"/users/{user_id}/", READ_TIMEOUT, idempotent=True)
+
+    async def get_user_lists(self, user_id: int) -> list:
+        data = await self._call("get_user_lists", "GET", f"/users/{user_id}/lists/", READ_TIMEOUT, idempotent=True,
+                                params={"summary": "true"})
+        return data.get("lists", [])
+
+    async def get_last_subscribed_list_id(self, user_id: int) -> Optional[str]:
+        data = await self._call("get_last_subscribed_list", "GET", f"/users/{user_id}/last_subscribed_list/",
+                                READ_TIMEOUT, idempotent=True)
+        return data.get("last_subscribed_list_id")
+
+    async def clear_last_subscribed_list(self, user_id: int):
+        await self._call("clear_last_subscribed_list", "POST", f"/users/{user_id}/clear_last_subscribed_list/",
+                         idempotent=True)
+
+    async def record_user_action(self, user_id: int, chat_id: Optional[int] = None, username: Optional[str] = None):
+        data = {"user_id": user_id}
+        if chat_id is not None or username is not None:
+            data.update(chat_id=chat_id, username=username)
+        await self._call("record_user_action", "POST", "/users/actions/", json=data)
+
+    async def create_list(self, user_id: int) -> str:
+        data = await self._call("create_list", "POST", "/lists/", params={"user_id": user_id})
+        return data.get("list_id")
+
+    async def share_list(self, list_id: str, user_id: int) -> dict:
+        return await self._call("share_list", "POST", f"/lists/{list_id}/share/", json={"user_id": user_id})
+
+    async def unsubscribe(self, list_id: str, user_id: int) -> dict:
+        return await self._call("unsubscribe", "POST", f"/lists/{list_id}/unsubscribe/", json={"user_id": user_id})
+
+    async def add_items_bulk(self, list_id: str, item_names: list) -> dict:
+        return await self._call("add_items_bulk", "POST", f"/lists/{list_id}/items/bulk/", HEAVY_TIMEOUT,
+                                params={"return_list": "true"},
+                                json={"items": [{"item_name": name} for name in item_names]})
+
+    async def apply_list_ops(self, list_id: str, ops: list, user_id: int) -> dict:
+        return await self._call("apply_list_ops", "POST", f"/lists/{list_id}/ops/", HEAVY_TIMEOUT,
+                                params={"return_list": "true"}, json={"ops": ops, "user_id": user_id})
+
+    async def complete_list(self, list_id: str) -> dict:
+        return await self._call("complete_list", "POST", f"/lists/{list_id}/complete/", HEAVY_TIMEOUT)
+
+    async def set_list_notification(self, list_id: str, notification_text: str):
+        await self._call("set_list_notification", "POST", f"/lists/{list_id}/notification/", idempotent=True,
+                         json={"notification_text": notification_text})
+
+    async def clear_list_notification(self, list_id: str):
+        await self._call("clear_list_notification", "POST", f"/lists/{list_id}/clear_notification/",
+                         idempotent=True)
+
+    async def get_last_message_ids(self, user_id: int, list_id: str) -> list:
+        data = await self._call("get_last_messages", "GET", f"/utils/{user_id}/lists/{list_id}/last_message/",
+                                READ_TIMEOUT, idempotent=True)
+        return data.get("last_message_ids", [])
+
+    async def add_last_message(self, user_id: int, list_id: str, message_id: int):
+        await self._call("add_last_message", "POST", f"/utils/{user_id}/lists/{list_id}/last_message/",
+                         json={"message_id": message_id})
+
+    async def delete_last_message(self, user_id: int, list_id: str, message_id: int):
+        await self._call("delete_last_message", "DELETE",
+                         f"/utils/{user_id}/lists/{list_id}/last_message/{message_id}/", idempotent=True)
+
+    async def delete_one_last_message(self, user_id: int, list_id: str, message_id: int):
+        await self._call("delete_one_last_message", "DELETE",
+                         f"/utils/{user_id}/lists/{list_id}/last_message/{message_id}/delete_one/", idempotent=True)
+
+    async def set_skip_confirm(self, user_id: int, list_id: str, value: bool):
+        await self._call("set_skip_confirm", "POST", f"/utils/{user_id}/lists/{list_id}/skip_confirm/",
+                         idempotent=True, json={"value": value})
+
+    async def set_current_page(self, user_id: int, list_id: str, page: int):
+        await self._call("set_current_page", "POST", f"/utils/{user_id}/lists/{list_id}/current_page/",
+                         idempotent=True, json={"page": page})
+
+    async def get_admin_stats(self, admin_token: str, days: int = 7) -> dict:
+        return await self._call("get_admin_stats", "GET", "/stats/admin", STATS_TIMEOUT, idempotent=True,
+                                params={"days": days}, headers={"X-Admin-Token": admin_token})
@@ -2,10 +2,18 @@ import logging
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from prometheus_client import start_http_server
 
-from config import BOT_TOKEN, BACKEND_URL
+from backend_client import BackendClient
+from config import (BOT_TOKEN, ADMINS, ADMIN_TOKEN, BACKEND_URL, ACTIONS_FLUSH_INTERVAL, ETAG_CACHE_SIZE,
+    USER_CACHE_SIZE, USER_CACHE_TTL, OPS_FLUSH_DELAY, USE_MSGPACK, METRICS_PORT, TELEGRAM_API_URL, MESSAGE_RATE,
+    MESSAGE_BURST, MESSAGE_QUEUE_SIZE, BACKEND_MAX_CONNECTIONS, BACKEND_MAX_KEEPALIVE, BACKEND_KEEPALIVE_EXPIRY,
+    BACKEND_HTTP2, BACKEND_RETRIES, BACKEND_RETRY_BACKOFF)
 from handlers import Handlers
+from metrics import TelegramMetricsMiddleware
 from utils import BotUtils
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -15,13 +23,23 @@ logger = logging.getLogger(__name__)
 
 class Bot:
     def __init__(self):
-        self.bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-        self.bot_utils = BotUtils(self.bot, BACKEND_URL)
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+        self.bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        self.bot.session.middleware(TelegramMetricsMiddleware())
+        backend = BackendClient(BACKEND_URL, USE_MSGPACK, ETAG_CACHE_SIZE, BACKEND_MAX_CONNECTIONS,
+                                BACKEND_MAX_KEEPALIVE, BACKEND_KEEPALIVE_EXPIRY, BACKEND_HTTP2, BACKEND_RETRIES,
+                                BACKEND_RETRY_BACKOFF)
+        self.bot_utils = BotUtils(self.bot, backend, ACTIONS_FLUSH_INTERVAL, OPS_FLUSH_DELAY, USER_CACHE_SIZE,
+                                  USER_CACHE_TTL)
         self.dp = Dispatcher()
-        self.handlers = Handlers(self.bot_utils)
+        self.handlers = Handlers(self.bot_utils, ADMINS, ADMIN_TOKEN, MESSAGE_RATE, MESSAGE_BURST,
+                                 MESSAGE_QUEUE_SIZE)
         self.dp.include_router(self.handlers.router)
 
     async def launch_bot(self):
+        if METRICS_PORT:
+            start_http_server(METRICS_PORT)
+            logger.info(f"Метрики доступны на порту {METRICS_PORT}")
         try:
             await self.bot.delete_webhook(drop_pending_updates=True)
             await self.dp.start_polling(self.bot, allowed_updates=self.dp.resolve_used_update_types())
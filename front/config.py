@@ -7,6 +7,24 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMINS = [int(admin_id.strip()) for admin_id in os.getenv("ADMINS", "").split(",")] if os.getenv("ADMINS") else []
 BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:8001")
+ACTIONS_FLUSH_INTERVAL = float(os.getenv("ACTIONS_FLUSH_INTERVAL", 2.0))
+ETAG_CACHE_SIZE = int(os.getenv("ETAG_CACHE_SIZE", 500))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 3600))
+OPS_FLUSH_DELAY = float(os.getenv("OPS_FLUSH_DELAY", 0.2))
+USE_MSGPACK = os.getenv("USE_MSGPACK", "false").lower() == "true"
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", 100))
+BACKEND_MAX_KEEPALIVE = int(os.getenv("BACKEND_MAX_KEEPALIVE", 20))
+BACKEND_KEEPALIVE_EXPIRY = float(os.getenv("BACKEND_KEEPALIVE_EXPIRY", 30.0))
+BACKEND_HTTP2 = os.getenv("BACKEND_HTTP2", "false").lower() == "true"
+BACKEND_RETRIES = int(os.getenv("BACKEND_RETRIES", 2))
+BACKEND_RETRY_BACKOFF = float(os.getenv("BACKEND_RETRY_BACKOFF", 0.1))
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+MESSAGE_RATE = float(os.getenv("MESSAGE_RATE", 1.0))
+MESSAGE_BURST = int(os.getenv("MESSAGE_BURST", 3))
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", 50))
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в переменных окружения.")
@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+
+import httpx
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from aiogram.types import Update
+
+from backend_client import BackendClient
+from fake_telegram import FakeTelegramServer
+from handlers import Handlers
+from utils import BotUtils
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()])
+logger = logging.getLogger("e2e_bench")
+logger.setLevel(logging.INFO)
+
+FIRST_USER_ID = 8_000_000_000
+DEFAULT_MIX = "message=40,toggle=35,page=15,delete=5,sort=5"
+CALLBACK_PREFIXES = {"toggle": "toggle_", "delete": "delete_", "page": ("next_", "prev_"), "sort": "sort_list_"}
+
+current_update = contextvars.ContextVar("current_update", default=None)
+
+
+class TelegramCallCounter(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        stats = current_update.get()
+        if stats is not None:
+            stats["telegram"] += 1
+        return await make_request(bot, method)
+
+
+async def count_backend_request(request: httpx.Request):
+    stats = current_update.get()
+    if stats is not None:
+        stats["backend"] += 1
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class BotBenchmark:
+    """Прогоняет апдейты через Dispatcher бота и считает вызовы бэкенда и Telegram на каждый апдейт.
+
+    Вызовы из фоновых задач, запущенных обработчиком (отложенная запись активности,
+    пакетные операции со списком), засчитываются апдейту, который их запустил.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, server: FakeTelegramServer, rng: random.Random):
+        self.bot = bot
+        self.dp = dp
+        self.server = server
+        self.rng = rng
+        self.update_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"bench_{user_id}"}
+
+    async def feed(self, kind: str, update: dict):
+        update = Update.model_validate(dict(update, update_id=next(self.update_ids)), context={"bot": self.bot})
+        stats = {"backend": 0, "telegram": 0}
+        token = current_update.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors[kind] += 1
+            logger.debug(f"{kind}: Ошибка обработки апдейта: {e}")
+        finally:
+            stats["latency"] = time.perf_counter() - start
+            current_update.reset(token)
+        self.samples[kind].append(stats)
+
+    async def send_text(self, user_id: int, text: str, kind: str = "message"):
+        message_id = self.server.register_user_message(user_id, text)
+        await self.feed(kind, {"message": {"message_id": message_id, "date": int(time.time()),
+                                           "chat": {"id": user_id, "type": "private"}, "from": self.user(user_id),
+                                           "text": text}})
+
+    async def tap(self, user_id: int, kind: str) -> bool:
+        message_id, buttons = self.server.latest_keyboard(user_id)
+        candidates = [data for data in buttons if data.startswith(CALLBACK_PREFIXES[kind])]
+        if not candidates:
+            return False
+        await self.feed(kind, {"callback_query": {
+            "id": str(next(self.callback_ids)), "from": self.user(user_id), "chat_instance": str(user_id),
+            "data": self.rng.choice(candidates),
+            "message": {"message_id": message_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+                        "text": ""}}})
+        return True
+
+    async def act(self, user_id: int, kind: str):
+        if kind != "message" and await self.tap(user_id, kind):
+            return
+        items = [f"Товар {self.rng.randint(0, 10 ** 6)}" for _ in range(self.rng.randint(1, 3))]
+        await self.send_text(user_id, "\n".join(items))
+
+    async def user_loop(self, user_id: int, deadline: float, kinds: list, weights: list, think_time: float):
+        while time.perf_counter() < deadline:
+            await self.act(user_id, self.rng.choices(kinds, weights)[0])
+            if think_time:
+                await asyncio.sleep(self.rng.uniform(0, 2 * think_time))
+
+    def report(self, duration: float) -> dict:
+        kinds = {}
+        for kind, samples in sorted(self.samples.items()):
+            latencies = sorted(sample["latency"] for sample in samples)
+            kinds[kind] = {"updates": len(samples), "errors": self.errors[kind],
+                           "backend_calls_per_update": round(sum(s["backend"] for s in samples) / len(samples), 2),
+                           "telegram_calls_per_update": round(sum(s["telegram"] for s in samples) / len(samples), 2),
+                           "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                           "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                           "p99_ms": round(percentile(latencies, 99) * 1000, 2)}
+        all_samples = [sample for samples in self.samples.values() for sample in samples]
+        total = len(all_samples) or 1
+        return {"duration_s": round(duration, 2), "updates": len(all_samples),
+                "updates_per_second": round(len(all_samples) / duration, 2),
+                "backend_calls_per_update": round(sum(s["backend"] for s in all_samples) / total, 2),
+                "telegram_calls_per_update": round(sum(s["telegram"] for s in all_samples) / total, 2),
+                "kinds": kinds, "telegram_api": self.server.stats()}
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - {"message"} - set(CALLBACK_PREFIXES)
+    if unknown:
+        raise SystemExit(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+    return weights
+
+
+async def run(args) -> dict:
+    weights = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    server = FakeTelegramServer(args.telegram_latency)
+    await server.start("127.0.0.1", args.telegram_port)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.telegram_port}"))
+    bot = Bot(token="123456:fake-token", session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(TelegramCallCounter())
+    backend = BackendClient(args.backend_url, args.use_msgpack, args.etag_cache_size, http2=args.http2,
+                            max_retries=args.retries)
+    bot_utils = BotUtils(bot, backend, args.actions_flush_interval, args.ops_flush_delay)
+    event_hooks = backend.http_client.event_hooks
+    event_hooks["request"].append(count_backend_request)
+    backend.http_client.event_hooks = event_hooks
+    dp = Dispatcher()
+    dp.include_router(Handlers(bot_utils).router)
+    benchmark = BotBenchmark(bot, dp, server, rng)
+
+    user_ids = [FIRST_USER_ID + index for index in range(args.users)]
+    groups = [user_ids[start:start + args.group_size] for start in range(0, len(user_ids), args.group_size)]
+    try:
+        await asyncio.gather(*(benchmark.send_text(group[0], "/start", "start") for group in groups))
+        owner_lists = await asyncio.gather(*(backend.get_user_lists(group[0]) for group in groups))
+        list_ids = [user_lists[0]["_id"] for user_lists in owner_lists]
+        await asyncio.gather(*(benchmark.send_text(member, f"/start {list_id}", "join")
+                               for group, list_id in zip(groups, list_ids) for member in group[1:]))
+        logger.info(f"Подготовлено {len(user_ids)} пользователей в {len(groups)} общих списках")
+
+        server.reset_stats()
+        benchmark.samples.clear()
+        benchmark.errors.clear()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(benchmark.user_loop(user_id, deadline, list(weights), list(weights.values()),
+                                                   args.think_time) for user_id in user_ids))
+        duration = time.perf_counter() - start
+        await bot_utils.flush_user_actions()
+        if bot_utils.background_tasks:
+            await asyncio.gather(*bot_utils.background_tasks, return_exceptions=True)
+        report = benchmark.report(duration)
+    finally:
+        await bot_utils.close_client()
+        await bot.session.close()
+        await server.stop()
+
+    report.update({"backend_url": args.backend_url, "users": args.users, "group_size": args.group_size,
+                   "mix": weights})
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2, ensure_ascii=False)
+    logger.info(f"Обработано {report['updates']} апдейтов, {report['updates_per_second']} апдейтов/с, "
+                f"{report['backend_calls_per_update']} вызовов бэкенда и {report['telegram_calls_per_update']} "
+                f"вызовов Telegram на апдейт. Отчет: {args.output}")
+    for kind, stats in report["kinds"].items():
+        logger.info(f"{kind}: p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms "
+                    f"backend={stats['backend_calls_per_update']} telegram={stats['telegram_calls_per_update']} "
+                    f"errors={stats['errors']}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Сквозной бенчмарк бота против фейкового Telegram Bot API и запущенного бэкенда.")
+    parser.add_argument("--backend-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--telegram-port", type=int, default=8081)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Задержка ответа Telegram API в секундах")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--group-size", type=int, default=3, help="Участников в одном общем списке")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--think-time", type=float, default=0.5, help="Средняя пауза пользователя между действиями")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--actions-flush-interval", type=float, default=2.0)
+    parser.add_argument("--etag-cache-size", type=int, default=500)
+    parser.add_argument("--ops-flush-delay", type=float, default=0.2)
+    parser.add_argument("--use-msgpack", action="store_true")
+    parser.add_argument("--http2", action="store_true")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--output", default="e2e_report.json")
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import Counter
+
+from aiohttp import web
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()])
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake Bot", "username": "fake_list_bot"}
+
+
+class FakeTelegramServer:
+    """Локальная замена Telegram Bot API для нагрузочных тестов бота.
+
+    Хранит отправленные сообщения по чатам и повторяет ошибки настоящего API
+    («message is not modified», «message to edit/delete not found»), чтобы количество
+    вызовов совпадало с поведением бота в продакшене.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.errors = Counter()
+        self.messages = {}
+        self.keyboards = {}
+        self.message_ids = itertools.count(1)
+        self.update_ids = itertools.count(1)
+        self.updates = []
+        self.updates_event = asyncio.Event()
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle_method)
+        self.app.router.add_get("/bot{token}/{method}", self.handle_method)
+        self.app.router.add_post("/updates", self.handle_push_update)
+        self.app.router.add_get("/stats", self.handle_stats)
+        self.runner = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logger.info(f"Фейковый Telegram Bot API запущен на http://{host}:{port}")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def push_update(self, update: dict) -> int:
+        update = dict(update, update_id=next(self.update_ids))
+        self.updates.append(update)
+        self.updates_event.set()
+        return update["update_id"]
+
+    def register_user_message(self, chat_id: int, text: str) -> int:
+        message_id = next(self.message_ids)
+        self.messages[(chat_id, message_id)] = (text, None)
+        return message_id
+
+    def latest_keyboard(self, chat_id: int):
+        """Возвращает (message_id, callback_data кнопок) последнего сообщения бота с клавиатурой."""
+        message_id, reply_markup = self.keyboards.get(chat_id, (None, None))
+        if message_id is None:
+            return None, []
+        buttons = [button.get("callback_data") for row in reply_markup.get("inline_keyboard", []) for button in row]
+        return message_id, [data for data in buttons if data]
+
+    def store_message(self, chat_id: int, message_id: int, text: str, reply_markup):
+        self.messages[(chat_id, message_id)] = (text, reply_markup)
+        if reply_markup:
+            self.keyboards[chat_id] = (message_id, reply_markup)
+        elif self.keyboards.get(chat_id, (None,))[0] == message_id:
+            del self.keyboards[chat_id]
+
+    def reset_stats(self):
+        self.calls.clear()
+        self.errors.clear()
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "errors": dict(self.errors), "total_calls": sum(self.calls.values())}
+
+    async def handle_push_update(self, request: web.Request) -> web.Response:
+        update_id = self.push_update(await request.json())
+        return web.json_response({"ok": True, "result": update_id})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(request.query)
+        if request.can_read_body:
+            params.update(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        handler = getattr(self, f"api_{method.lower()}", None)
+        if handler is None:
+            return self.error(method, 404, "Not Found: method not found")
+        result = await handler(params)
+        if isinstance(result, web.Response):
+            return result
+        return web.json_response({"ok": True, "result": result})
+
+    def error(self, method: str, code: int, description: str) -> web.Response:
+        self.errors[method] += 1
+        return web.json_response({"ok": False, "error_code": code, "description": description}, status=code)
+
+    def message(self, chat_id: int, message_id: int, text: str, reply_markup) -> dict:
+        message = {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                   "from": BOT_USER, "text": text}
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        return message
+
+    async def api_getme(self, params: dict):
+        return BOT_USER
+
+    async def api_deletewebhook(self, params: dict):
+        return True
+
+    async def api_getupdates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout:
+            self.updates_event.clear()
+            try:
+                await asyncio.wait_for(self.updates_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self.updates[:limit]
+
+    async def api_sendchataction(self, params: dict):
+        return True
+
+    async def api_answercallbackquery(self, params: dict):
+        return True
+
+    async def api_sendmessage(self, params: dict):
+        chat_id = int(params["chat_id"])
+        reply_markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+        message_id = next(self.message_ids)
+        self.store_message(chat_id, message_id, params.get("text", ""), reply_markup)
+        return self.message(chat_id, message_id, params.get("text", ""), reply_markup)
+
+    async def api_editmessagetext(self, params: dict):
+        chat_id, message_id = int(params["chat_id"]), int(params["message_id"])
+        reply_markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+        stored = self.messages.get((chat_id, message_id))
+        if stored is None:
+            return self.error("editMessageText", 400, "Bad Request: message to edit not found")
+        if stored == (params.get("text", ""), reply_markup):
+            return self.error("editMessageText", 400,
+                              "Bad Request: message is not modified: specified new message content and reply "
+                              "markup are exactly the same as a current content and reply markup of the message")
+        self.store_message(chat_id, message_id, params.get("text", ""), reply_markup)
+        return self.message(chat_id, message_id, params.get("text", ""), reply_markup)
+
+    async def api_deletemessage(self, params: dict):
+        key = (int(params["chat_id"]), int(params["message_id"]))
+        if self.messages.pop(key, None) is None:
+            return self.error("deleteMessage", 400, "Bad Request: message to delete not found")
+        if self.keyboards.get(key[0], (None,))[0] == key[1]:
+            del self.keyboards[key[0]]
+        return True
+
+
+async def serve(host: str, port: int, latency: float):
+    server = FakeTelegramServer(latency)
+    await server.start(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API для локальных тестов бота.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Искусственная задержка ответа в секундах")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.latency))
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 import httpx
@@ -6,58 +7,87 @@ from aiogram.enums import ParseMode
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 
-from utils import BotUtils
+from metrics import MESSAGE_THROTTLE_EVENTS
+from backend_client import decode_response
+from utils import BotUtils, TokenBucket
 
 logger = logging.getLogger(__name__)
 
+TOTAL_STATS_LABELS = {"users": "Пользователей", "open_lists": "Открытых списков", "items_added": "Добавлено товаров",
+                      "items_bought": "Куплено товаров", "lists_completed": "Завершено списков"}
+DAILY_STATS_LABELS = {"active_users": "активных", "new_users": "новых", "lists_created": "списков",
+                      "items_added": "добавлено", "items_bought": "куплено"}
+
 
 class Handlers:
-    def __init__(self, bot_utils: BotUtils):
+    def __init__(self, bot_utils: BotUtils, admins: list = None, admin_token: str = None, message_rate: float = 1.0,
+                 message_burst: int = 3, message_queue_size: int = 50):
         self.bot_utils = bot_utils
+        self.admins = set(admins or [])
+        self.admin_token = admin_token
+        self.message_bucket = TokenBucket(message_rate, message_burst)
+        self.message_queue_size = message_queue_size
+        self.pending_messages = {}
         self.router = Router()
         self._setup_routers()
 
     def _setup_routers(self):
         self.router.message.register(self.start_route, Command('start'))
+        self.router.message.register(self.stats_route, Command('stats'))
         self.router.message.register(self.handle_shopping_list)
         self.router.callback_query.register(self.handle_callback)
 
+    async def stats_route(self, message: Message):
+        if message.from_user.id not in self.admins:
+            await self.handle_shopping_list(message)
+            return
+        if not self.admin_token:
+            await message.answer("Статистика недоступна: не задан <b>ADMIN_TOKEN</b>.")
+            return
+        try:
+            stats = await self.bot_utils.backend.get_admin_stats(self.admin_token, 7)
+        except httpx.HTTPError as e:
+            logger.error(f"Ошибка получения статистики: {e}")
+            await message.answer("<b>Не удалось получить</b> статистику.")
+            return
+
+        lines = ["<b>Статистика</b>"]
+        lines += [f"{label}: <b>{stats['totals'].get(key, 0)}</b>" for key, label in TOTAL_STATS_LABELS.items()]
+        lines.append("")
+        lines.append("<b>По дням</b>")
+        for day in stats["days"]:
+            lines.append(f"{day['day']}: " + ", ".join(f"{label} {day.get(key, 0)}"
+                                                      for key, label in DAILY_STATS_LABELS.items()))
+        await message.answer("\n".join(lines))
+
     async def start_route(self, message: Message):
         user_id = await self.bot_utils.extract_id_and_send_typing(message)
         if user_id is None:
             return
 
         username = message.from_user.username or "Unknown"
-        user_action_data = {"user_id": user_id, "chat_id": message.chat.id, "username": username}
-        try:
-            await self.bot_utils.http_client.post(f"{self.bot_utils.backend_url}/users/actions/", json=user_action_data,
-                                                  timeout=10)
-        except httpx.HTTPError as e:
-            logger.error(f"Ошибка обновления действия пользователя: {e}")
+        await self.bot_utils.record_user_action(user_id, message.chat.id, username)
 
         if len(message.text.split()) > 1:
             list_id = message.text.split()[1]
-            share_data = {"user_id": user_id}
 
             try:
-                list_detail_response = await self.bot_utils.http_client.get(
-                    f"{self.bot_utils.backend_url}/lists/{list_id}/", timeout=10)
-                list_detail_response.raise_for_status()
-                list_data = list_detail_response.json()
+                list_data = await self.bot_utils.backend.get_list(list_id)
                 if user_id in list_data.get("users", []):
                     await message.answer("Вы <b>уже добавлены</b> в этот список!")
                     return
 
-                response = await self.bot_utils.http_client.post(f"{self.bot_utils.backend_url}/lists/{list_id}/share/",
-                                                                 json=share_data, timeout=10)
-                if response.status_code == 400:
-                    error_detail = response.json().get("detail", "")
+                try:
+                    await self.bot_utils.backend.share_list(list_id, user_id)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code != 400:
+                        raise
+                    error_detail = decode_response(e.response).get("detail", "")
                     if "User might already be in this or another list" in error_detail:
                         await message.answer("Вы <b>уже состоите в другом списке!</b>")
                     else:
                         await message.answer("<b>Не удалось добавить</b> в список. Ошибка 400.")
                 else:
-                    response.raise_for_status()
                     await message.answer("Вы <b>добавлены</b> в список!")
                     await self.bot_utils.update_shopping_list_message(message.chat.id, user_id, list_id)
 
@@ -66,11 +96,7 @@ class Handlers:
                 await message.answer("<b>Не удалось добавить</b> в список.")
         else:
             try:
-                response = await self.bot_utils.http_client.get(f"{self.bot_utils.backend_url}/users/{user_id}/lists/",
-                                                                timeout=10)
-                response.raise_for_status()
-                user_lists_data = response.json()
-                user_lists = user_lists_data.get("lists", [])
+                user_lists = await self.bot_utils.backend.get_user_lists(user_id)
 
                 filtered_lists = []
 
@@ -86,10 +112,7 @@ class Handlers:
                     list_id = await self._get_or_create_list(user_id)
                 logger.info(list_id)
                 try:
-                    list_detail_response = await self.bot_utils.http_client.get(
-                        f"{self.bot_utils.backend_url}/lists/{list_id}/", timeout=10)
-                    list_detail_response.raise_for_status()
-                    list_data = list_detail_response.json()
+                    list_data = await self.bot_utils.backend.get_list(list_id)
                     items = list_data.get("items", [])
 
                     if not items:
@@ -111,15 +134,10 @@ class Handlers:
                 return
 
             try:
-                response = await self.bot_utils.http_client.get(
-                    f"{self.bot_utils.backend_url}/utils/{user_id}/lists/{list_id}/last_message/", timeout=10)
-                response.raise_for_status()
-                last_message_ids = response.json().get("last_message_ids", [])
+                last_message_ids = await self.bot_utils.backend.get_last_message_ids(user_id, list_id)
                 for msg_id in last_message_ids:
                     await self.bot_utils.bot.delete_message(message.chat.id, msg_id)
-                    await self.bot_utils.http_client.delete(
-                        f"{self.bot_utils.backend_url}/utils/{user_id}/lists/{list_id}/last_message/{msg_id}/",
-                        timeout=10)
+                    await self.bot_utils.backend.delete_last_message(user_id, list_id, msg_id)
             except Exception as e:
                 logger.error(f"<b>Ошибка удаления</b> старых сообщений: {e}")
 
@@ -127,15 +145,9 @@ class Handlers:
             await self.bot_utils.update_shopping_list_message(message.chat.id, user_id, list_id)
 
     async def _get_or_create_list(self, user_id):
-        response = await self.bot_utils.http_client.get(f"{self.bot_utils.backend_url}/users/{user_id}/lists/",
-                                                        timeout=10)
-        response.raise_for_status()
-        user_lists = response.json().get("lists", [])
+        user_lists = await self.bot_utils.backend.get_user_lists(user_id)
         if not user_lists:
-            create_response = await self.bot_utils.http_client.post(
-                f"{self.bot_utils.backend_url}/lists/?user_id={user_id}", timeout=10)
-            create_response.raise_for_status()
-            return create_response.json().get("list_id")
+            return await self.bot_utils.backend.create_list(user_id)
         active_list = next((lst for lst in user_lists if not lst.get("completed", False)), user_lists[0])
         return active_list["_id"]
 
@@ -145,65 +157,89 @@ class Handlers:
             return
 
         username = message.from_user.username or "Unknown"
-        user_action_data = {"user_id": user_id, "chat_id": message.chat.id, "username": username}
-        try:
-            await self.bot_utils.http_client.post(f"{self.bot_utils.backend_url}/users/actions/", json=user_action_data,
-                                                  timeout=10)
-        except httpx.HTTPError as e:
-            logger.error(f"Ошибка обновления действия пользователя: {e}")
+        await self.bot_utils.record_user_action(user_id, message.chat.id, username)
 
         if message.content_type != "text":
             await message.reply("Поддерживаются <b>только текстовые сообщения.</b>")
             await self.bot_utils.bot.delete_message(message.chat.id, message.message_id)
             return
 
-        try:
-            response = await self.bot_utils.http_client.get(
-                f"{self.bot_utils.backend_url}/users/{user_id}/last_subscribed_list/", timeout=10)
-            response.raise_for_status()
-            list_id = response.json().get("last_subscribed_list_id") or await self._get_or_create_list(user_id)
-        except httpx.HTTPError as e:
-            logger.error(f"Ошибка получения списка: {e}")
-            await message.reply("<b>Ошибка</b> при работе со списками.")
-            return
-
         text = message.text or message.caption or ""
         items = [item.strip() for item in text.split('\n') if item.strip()]
 
         if not items:
             return
 
+        pending = self.pending_messages.get(user_id)
+        if pending is None and self.message_bucket.try_acquire(user_id):
+            await self._add_items(user_id, items, [message])
+            return
+        self._queue_items(user_id, items, message)
+
+    def _queue_items(self, user_id: int, items: list, message: Message):
+        """Откладывает сообщение, превысившее лимит: все отложенные сообщения пользователя
+        добавляются одним запросом и одной перерисовкой списка, когда появится токен."""
+        pending = self.pending_messages.get(user_id)
+        if pending is None:
+            pending = {"items": [], "messages": [], "dropped": 0}
+            self.pending_messages[user_id] = pending
+            self.bot_utils.spawn(self._flush_pending_items(user_id))
+            MESSAGE_THROTTLE_EVENTS.labels("throttled").inc()
+        elif len(pending["messages"]) >= self.message_queue_size:
+            pending["dropped"] += 1
+            MESSAGE_THROTTLE_EVENTS.labels("dropped").inc()
+            return
+        else:
+            MESSAGE_THROTTLE_EVENTS.labels("merged").inc()
+        pending["items"].extend(items)
+        pending["messages"].append(message)
+
+    async def _flush_pending_items(self, user_id: int):
+        await asyncio.sleep(self.message_bucket.delay(user_id))
+        self.message_bucket.try_acquire(user_id)
+        pending = self.pending_messages.pop(user_id)
+        await self._add_items(user_id, pending["items"], pending["messages"])
+        if pending["dropped"]:
+            await pending["messages"][-1].answer(
+                f"<b>Слишком много сообщений подряд:</b> {pending['dropped']} не добавлено, отправьте их еще раз.")
+
+    async def _add_items(self, user_id: int, items: list, messages: list):
+        message = messages[-1]
+        try:
+            list_id = (await self.bot_utils.backend.get_last_subscribed_list_id(user_id)
+                       or await self._get_or_create_list(user_id))
+        except httpx.HTTPError as e:
+            logger.error(f"Ошибка получения списка: {e}")
+            await message.reply("<b>Ошибка</b> при работе со списками.")
+            return
+
         try:
-            response = await self.bot_utils.http_client.post(
-                f"{self.bot_utils.backend_url}/lists/{list_id}/items/bulk/",
-                json={"items": [{"item_name": item} for item in items]}, timeout=10)
-            response.raise_for_status()
-            added_items = response.json().get("added_items", [])
+            result = await self.bot_utils.backend.add_items_bulk(list_id, items)
+            added_items = result.get("added_items", [])
+            list_data = result.get("list")
             if not added_items:
                 added_items = items
 
             if added_items:
                 last_item = added_items[-1]
-                await self.bot_utils.notify_list_change(list_id, user_id, action_type="add", item_name=last_item)
+                await self.bot_utils.notify_list_change(list_id, user_id, action_type="add", item_name=last_item,
+                                                        list_data=list_data)
         except httpx.HTTPError as e:
             logger.error(f"Ошибка добавления элементов списка: {e}")
             await message.reply(f"<b>Не удалось</b> добавить элементы списка.")
 
         await self.bot_utils.update_shopping_list_message(message.chat.id, user_id, list_id)
-        try:
-            await self.bot_utils.bot.delete_message(message.chat.id, message.message_id)
-        except Exception as e:
-            logger.error(f"Не удалось удалить сообщение: {e}")
+        results = await asyncio.gather(
+            *(self.bot_utils.bot.delete_message(item_message.chat.id, item_message.message_id)
+              for item_message in messages), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Не удалось удалить сообщение: {result}")
 
     async def handle_callback(self, callback: CallbackQuery):
         user_id = callback.from_user.id
         username = callback.from_user.username or "Unknown"
-        user_action_data = {"user_id": user_id, "chat_id": callback.message.chat.id, "username": username}
-        try:
-            await self.bot_utils.http_client.post(f"{self.bot_utils.backend_url}/users/actions/", json=user_action_data,
-                                                  timeout=10)
-        except httpx.HTTPError as e:
-            logger.error(f"Ошибка обновления действия пользователя: {e}")
+        await self.bot_utils.record_user_action(user_id, callback.message.chat.id, username)
 
         parts = callback.data.split("_")
         action = parts[0]
@@ -221,10 +257,8 @@ class Handlers:
         if action in ["complete", "confirm"] and "complete" in callback.data:
             list_id = parts[1] if action == "complete" else parts[2]
             try:
-                response = await self.bot_utils.http_client.get(f"{self.bot_utils.backend_url}/lists/{list_id}/",
-                                                                timeout=10)
-                response.raise_for_status()
-                if response.json()["owner_id"] == user_id:
+                list_data = await self.bot_utils.backend.get_list(list_id)
+                if list_data["owner_id"] == user_id:
                     await self.bot_utils.complete_list(user_id, list_id)
                     await callback.answer("Список завершен!")
                 else:
@@ -237,9 +271,7 @@ class Handlers:
         if action == "cancel" and parts[1] == "complete":
             list_id = parts[2]
             try:
-                await self.bot_utils.http_client.post(
-                    f"{self.bot_utils.backend_url}/utils/{user_id}/lists/{list_id}/skip_confirm/", json={"value": True},
-                    timeout=10)
+                await self.bot_utils.backend.set_skip_confirm(user_id, list_id, True)
                 await self.bot_utils.update_shopping_list_message(callback.message.chat.id, user_id, list_id)
                 await callback.answer("Список остается активным.")
             except httpx.HTTPError as e:
@@ -254,12 +286,6 @@ class Handlers:
             else:
                 await callback.answer(f"Вы на странице {int(parts[2]) + 1}")
             new_page = current_page - 1 if action == "prev" else current_page + 1
-            try:
-                await self.bot_utils.http_client.post(
-                    f"{self.bot_utils.backend_url}/utils/{user_id}/lists/{list_id}/current_page/",
-                    json={"page": new_page}, timeout=10)
-            except httpx.HTTPError as e:
-                logger.error(f"Ошибка сохранения страницы: {e}")
             await self.bot_utils.update_shopping_list_message(callback.message.chat.id, user_id, list_id, new_page)
             return
 
@@ -280,8 +306,7 @@ class Handlers:
         if action == "unsubscribe":
             list_id = parts[1]
             try:
-                await self.bot_utils.http_client.post(f"{self.bot_utils.backend_url}/lists/{list_id}/unsubscribe/",
-                                                      json={"user_id": user_id}, timeout=10)
+                await self.bot_utils.backend.unsubscribe(list_id, user_id)
                 await callback.answer("Вы отписались от списка.", show_alert=True)
                 await callback.message.delete()
                 await self.bot_utils.notify_list_change(list_id, user_id, action_type="unsubscribe")
@@ -294,48 +319,28 @@ class Handlers:
             return
 
         list_id, item_id, page = parts[1], parts[2], int(parts[3])
+        if action in ["toggle", "delete"]:
+            result = await self.bot_utils.queue_list_op(callback.message.chat.id, user_id, list_id, page,
+                                                        {"op": action, "item_id": item_id})
+            if result is None:
+                alert_text = "Не удалось изменить статус." if action == "toggle" else "Не удалось удалить элемент."
+            elif not result["ok"]:
+                await callback.answer()
+                return
+            elif action == "toggle":
+                item = result["item"]
+                status = "выполнено" if item["bought"] else "не выполнено"
+                alert_text = f"Статус '{item['name']}' изменен на {status}"
+            else:
+                alert_text = f"'{result['item']['name']}' удален из списка"
+            await callback.answer(alert_text)
+            return
+
         try:
-            response = await self.bot_utils.http_client.get(f"{self.bot_utils.backend_url}/lists/{list_id}/items/",
-                                                            timeout=10)
-            response.raise_for_status()
-            items = response.json().get("items", {})
+            items = await self.bot_utils.backend.get_list_items(list_id)
         except httpx.HTTPError as e:
             logger.error(f"Ошибка получения элементов списка: {e}")
             items = {}
 
-        if action == "toggle" and item_id in items:
-            try:
-                await self.bot_utils.http_client.put(
-                    f"{self.bot_utils.backend_url}/lists/{list_id}/items/{item_id}/toggle/", timeout=10)
-                await self.bot_utils.http_client.delete(
-                    f"{self.bot_utils.backend_url}/utils/{user_id}/lists/{list_id}/skip_confirm/", timeout=10)
-                response = await self.bot_utils.http_client.get(f"{self.bot_utils.backend_url}/lists/{list_id}/items/",
-                                                                timeout=10)
-                updated_items = response.json().get("items", {})
-                status = "выполнено" if updated_items[item_id]["bought"] else "не выполнено"
-                alert_text = f"Статус '{updated_items[item_id]['name']}' изменен на {status}"
-                item_name = updated_items[item_id]["name"]
-                await self.bot_utils.notify_list_change(list_id, user_id, action_type="toggle", item_name=item_name)
-            except httpx.HTTPError as e:
-                logger.error(f"Ошибка изменения статуса: {e}")
-                alert_text = "Не удалось изменить статус."
-        elif action == "delete" and item_id in items:
-            try:
-                item_name = items[item_id]["name"]
-                await self.bot_utils.http_client.delete(
-                    f"{self.bot_utils.backend_url}/lists/{list_id}/items/{item_id}/", timeout=10)
-                await self.bot_utils.http_client.delete(
-                    f"{self.bot_utils.backend_url}/utils/{user_id}/lists/{list_id}/skip_confirm/", timeout=10)
-                alert_text = f"'{item_name}' удален из списка"
-                await self.bot_utils.notify_list_change(list_id, user_id, action_type="delete", item_name=item_name)
-            except httpx.HTTPError as e:
-                logger.error(f"Ошибка удаления элемента: {e}")
-                alert_text = "Не удалось удалить элемент."
-        elif action == "none" and item_id in items:
+        if action == "none" and item_id in items:
             await callback.answer(f"'{items[item_id]['name']}' - выберите действие")
-            return
-        else:
-            return
-
-        await self.bot_utils.update_shopping_list_message(callback.message.chat.id, user_id, list_id, page)
-        await callback.answer(alert_text or "")
@@ -0,0 +1,60 @@
+import re
+import time
+
+import httpx
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from prometheus_client import Counter, Histogram
+
+BACKEND_REQUEST_LATENCY = Histogram("bot_backend_request_duration_seconds", "Backend API call latency",
+                                    ["method", "endpoint", "status"])
+BACKEND_CALL_LATENCY = Histogram("bot_backend_call_duration_seconds", "Backend client call latency including retries",
+                                 ["call"])
+BACKEND_CALL_RETRIES = Counter("bot_backend_call_retries_total", "Backend client call retries", ["call", "reason"])
+BACKEND_CALL_ERRORS = Counter("bot_backend_call_errors_total", "Backend client calls that failed after retries",
+                              ["call", "error"])
+TELEGRAM_REQUEST_LATENCY = Histogram("bot_telegram_request_duration_seconds", "Telegram Bot API call latency",
+                                     ["method", "status"])
+USER_PROFILE_CACHE_EVENTS = Counter("bot_user_profile_cache_events_total", "User profile cache lookups",
+                                    ["event"])
+MESSAGE_THROTTLE_EVENTS = Counter("bot_message_throttle_events_total",
+                                  "Item messages over the per-user rate limit that started a deferred batch "
+                                  "(throttled), joined a queued batch (merged) or did not fit into it (dropped)",
+                                  ["event"])
+
+ID_SEGMENT = re.compile(r"/(-?\d+|[0-9a-f]{24})(?=/|$)")
+
+
+def endpoint_template(path: str) -> str:
+    return ID_SEGMENT.sub("/{id}", path)
+
+
+class MetricsTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            BACKEND_REQUEST_LATENCY.labels(request.method, endpoint_template(request.url.path), status).observe(
+                time.perf_counter() - start)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = await make_request(bot, method)
+            status = "ok"
+            return response
+        finally:
+            api_method = getattr(method, "__api_method__", type(method).__name__)
+            TELEGRAM_REQUEST_LATENCY.labels(api_method, status).observe(time.perf_counter() - start)
@@ -1,36 +1,96 @@
+import asyncio
 import logging
+import time
+from collections import OrderedDict
 
 import httpx
 from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ParseMode
 
+from backend_client import BackendClient
+from metrics import USER_PROFILE_CACHE_EVENTS
+
 logger = logging.getLogger(__name__)
 
 
+class TokenBucket:
+    """Token bucket per key: `rate` tokens per second, at most `burst` stored. `rate <= 0` disables the limit."""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    def _tokens(self, key) -> tuple:
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated_at) * self.rate), now
+
+    def try_acquire(self, key) -> bool:
+        if self.rate <= 0:
+            return True
+        tokens, now = self._tokens(key)
+        allowed = tokens >= 1
+        self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+        self.buckets.move_to_end(key)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return allowed
+
+    def delay(self, key) -> float:
+        if self.rate <= 0:
+            return 0.0
+        tokens, _ = self._tokens(key)
+        return max(0.0, (1 - tokens) / self.rate)
+
+
+class ProfileCache:
+    """LRU-кэш профилей пользователей (chat_id, username) с временем жизни записи `ttl` секунд."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, user_id: int):
+        entry = self.entries.get(user_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            USER_PROFILE_CACHE_EVENTS.labels("miss").inc()
+            return None
+        self.entries.move_to_end(user_id)
+        USER_PROFILE_CACHE_EVENTS.labels("hit").inc()
+        return entry[1]
+
+    def put(self, user_id: int, chat_id: int, username: str):
+        if self.max_size <= 0:
+            return
+        self.entries[user_id] = (time.monotonic(), {"chat_id": chat_id, "username": username})
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
 class BotUtils:
-    def __init__(self, bot_instance: Bot, backend_url: str):
+    def __init__(self, bot_instance: Bot, backend: BackendClient, actions_flush_interval: float = 2.0,
+                 ops_flush_delay: float = 0.2, user_cache_size: int = 10000, user_cache_ttl: float = 3600.0):
         self.bot = bot_instance
-        self.backend_url = backend_url
-        self.http_client = httpx.AsyncClient()
+        self.backend = backend
         self.sort_states = {}
-
-    def generate_keyboard(self, list_id: str, item_list: list, completed: bool, owner_id: int, user_id: int,
-                          current_page: int = 1, sorted_items=False) -> InlineKeyboardMarkup:
-        if sorted_items:
-            item_list = sorted(item_list, key=lambda x: x["name"].lower())
-
+        self.actions_flush_interval = actions_flush_interval
+        self.pending_actions = {}
+        self.sent_profiles = {}
+        self.actions_flush_task = None
+        self.ops_flush_delay = ops_flush_delay
+        self.pending_ops = {}
+        self.background_tasks = set()
+        self.user_profiles = ProfileCache(user_cache_size, user_cache_ttl)
+
+    def generate_keyboard(self, list_id: str, page_items: list, completed: bool, owner_id: int, user_id: int,
+                          current_page: int = 1, total_items: int = 0, total_pages: int = 0,
+                          sorted_items=False) -> InlineKeyboardMarkup:
         buttons = []
         items_per_page = 6
-        total_items = len(item_list)
-        total_pages = (total_items + items_per_page - 1) // items_per_page if total_items > 0 else 0
-
-        if total_items > items_per_page and not completed:
-            start = (current_page - 1) * items_per_page
-            end = min(start + items_per_page, total_items)
-            page_items = item_list[start:end]
-        else:
-            page_items = item_list
-
         start_number = (current_page - 1) * items_per_page + 1
 
         for index, item in enumerate(page_items):
@@ -55,7 +115,7 @@ class BotUtils:
                 text="➡️", callback_data="disabled_next"))
             buttons.append([prev_button, page_button, next_button])
 
-        if not completed and item_list:
+        if not completed and total_items:
             if sorted_items == True:
                 buttons.append(
                     [InlineKeyboardButton(text="Сортировка ✅", callback_data=f"sort_list_{list_id}_{current_page}")])
@@ -78,7 +138,109 @@ class BotUtils:
              InlineKeyboardButton(text="Нет", callback_data=f"cancel_complete_{list_id}")]])
 
     async def close_client(self):
-        await self.http_client.aclose()
+        if self.actions_flush_task and not self.actions_flush_task.done():
+            self.actions_flush_task.cancel()
+        await self.flush_user_actions()
+        await self.backend.aclose()
+
+    def spawn(self, coro):
+        """Запускает корутину в фоне, хранит ссылку на задачу до ее завершения и логирует ее ошибку."""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self._finish_task)
+        return task
+
+    def _finish_task(self, task: asyncio.Task):
+        self.background_tasks.discard(task)
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None:
+            logger.exception(f"Ошибка фоновой задачи {task.get_name()}: {e}", exc_info=e)
+
+    async def queue_list_op(self, chat_id: int, user_id: int, list_id: str, page: int, op: dict):
+        key = (list_id, user_id)
+        batch = self.pending_ops.get(key)
+        if batch is None:
+            batch = {"chat_id": chat_id, "ops": [], "futures": []}
+            self.pending_ops[key] = batch
+            self.spawn(self._flush_list_ops_later(key))
+        batch["page"] = page
+        future = asyncio.get_running_loop().create_future()
+        batch["ops"].append(op)
+        batch["futures"].append(future)
+        return await future
+
+    async def _flush_list_ops_later(self, key):
+        await asyncio.sleep(self.ops_flush_delay)
+        batch = self.pending_ops.pop(key)
+        list_id, user_id = key
+        results, list_data = [], None
+        try:
+            result = await self.backend.apply_list_ops(list_id, batch["ops"], user_id)
+            results = result.get("results", [])
+            list_data = result.get("list")
+        except Exception as e:
+            logger.error(f"Ошибка применения операций к списку {list_id}: {e}")
+            results, list_data = [], None
+        finally:
+            for index, future in enumerate(batch["futures"]):
+                if not future.done():
+                    future.set_result(results[index] if index < len(results) else None)
+
+        try:
+            applied = [result for result in results if result.get("ok") and result.get("item")]
+            if not list_data or not applied:
+                return
+            last_applied = applied[-1]
+            await self.notify_list_change(list_id, user_id, action_type=last_applied["op"],
+                                          item_name=last_applied["item"]["name"], list_data=list_data)
+            await self.update_shopping_list_message(batch["chat_id"], user_id, list_id, batch["page"])
+        except Exception as e:
+            logger.exception(f"Ошибка обновления списка {list_id} после операций: {e}")
+
+    async def get_user_profile(self, user_id: int) -> dict:
+        profile = self.user_profiles.get(user_id)
+        if profile is None:
+            user_data = await self.backend.get_user(user_id)
+            profile = {"chat_id": user_data.get("chat_id"), "username": user_data.get("username")}
+            if profile["chat_id"]:
+                self.user_profiles.put(user_id, profile["chat_id"], profile["username"])
+        return profile
+
+    async def record_user_action(self, user_id: int, chat_id: int, username: str):
+        self.user_profiles.put(user_id, chat_id, username)
+        if self.sent_profiles.get(user_id) != (chat_id, username):
+            self.pending_actions.pop(user_id, None)
+            await self._send_user_action(user_id, chat_id, username)
+            return
+        self.pending_actions[user_id] = (chat_id, username)
+        if self.actions_flush_task is None or self.actions_flush_task.done():
+            self.actions_flush_task = asyncio.create_task(self._flush_user_actions_later())
+
+    async def _flush_user_actions_later(self):
+        await asyncio.sleep(self.actions_flush_interval)
+        await self.flush_user_actions()
+
+    async def flush_user_actions(self):
+        pending, self.pending_actions = self.pending_actions, {}
+        await asyncio.gather(*(self._send_user_action(user_id, chat_id, username)
+                               for user_id, (chat_id, username) in pending.items()))
+
+    async def _send_user_action(self, user_id: int, chat_id: int, username: str):
+        profile_changed = self.sent_profiles.get(user_id) != (chat_id, username)
+        try:
+            if profile_changed:
+                await self.backend.record_user_action(user_id, chat_id, username)
+            else:
+                await self.backend.record_user_action(user_id)
+        except httpx.HTTPError as e:
+            logger.error(f"Ошибка обновления действия пользователя: {e}")
+            return
+        self.sent_profiles.pop(user_id, None)
+        self.sent_profiles[user_id] = (chat_id, username)
+        if len(self.sent_profiles) > 10000:
+            self.sent_profiles.pop(next(iter(self.sent_profiles)))
 
     async def extract_id_and_send_typing(self, message):
         user_id = message.from_user.id
@@ -91,9 +253,7 @@ class BotUtils:
 
     async def complete_list(self, user_id: int, list_id: str):
         try:
-            response = await self.http_client.get(f"{self.backend_url}/lists/{list_id}/", timeout=10)
-            response.raise_for_status()
-            list_data = response.json()
+            list_data = await self.backend.get_list(list_id)
         except httpx.HTTPError as e:
             logger.error(f"Ошибка получения данных списка: {e}")
             return
@@ -102,9 +262,7 @@ class BotUtils:
             return
 
         try:
-            response = await self.http_client.post(f"{self.backend_url}/lists/{list_id}/complete/", timeout=10)
-            response.raise_for_status()
-            completion_data = response.json()
+            completion_data = await self.backend.complete_list(list_id)
             users = completion_data.get("users", [])
             items = completion_data.get("items", [])
             last_message_ids_for_users = completion_data.get("last_message_ids_for_users", {})
@@ -117,10 +275,7 @@ class BotUtils:
 
         for uid in users:
             try:
-                response = await self.http_client.get(f"{self.backend_url}/users/{uid}/", timeout=10)
-                response.raise_for_status()
-                user_data = response.json()
-                chat_id = user_data.get("chat_id")
+                chat_id = (await self.get_user_profile(uid)).get("chat_id")
             except httpx.HTTPError as e:
                 logger.warning(f"Ошибка получения данных пользователя: {e}")
                 chat_id = None
@@ -145,8 +300,7 @@ class BotUtils:
         try:
             for uid in users:
                 try:
-                    await self.http_client.post(f"{self.backend_url}/users/{uid}/clear_last_subscribed_list/",
-                                                json={"list_id": list_id}, timeout=10)
+                    await self.backend.clear_last_subscribed_list(uid)
                 except httpx.HTTPError as e:
                     logger.warning(f"Ошибка очистки last_subscribed_list_id для пользователя {uid}: {e}")
         except Exception as e:
@@ -157,51 +311,30 @@ class BotUtils:
         logger.debug(
             f"START update_shopping_list_message: chat_id={chat_id}, user_id={user_id}, list_id={list_id}, current_page={current_page}")
 
-        if current_page is None:
-            try:
-                response = await self.http_client.get(
-                    f"{self.backend_url}/utils/{user_id}/lists/{list_id}/current_page/", timeout=10)
-                response.raise_for_status()
-                current_page_data = response.json()
-                current_page = current_page_data.get("current_page", 1)
-            except httpx.HTTPError as e:
-                logger.error(f"Ошибка получения текущей страницы: {e}")
-                current_page = 1
-
+        sorted_items_state = self.sort_states.get(list_id, False)
         try:
-            response = await self.http_client.get(f"{self.backend_url}/lists/{list_id}/", timeout=10)
-            response.raise_for_status()
-            list_data = response.json()
-            last_notification_text = list_data.get("last_notification_text")
+            view = await self.backend.get_list_view(user_id, list_id, current_page,
+                                                    "name" if sorted_items_state else "insertion")
         except httpx.HTTPError as e:
             logger.warning(f"Ошибка получения списка {list_id}: {e}")
             return
 
+        list_data = view.get("list")
         if not list_data:
             logger.warning(f"Список {list_id} не найден.")
             return
 
+        stored_page = view.get("current_page", 1)
+        items_page = view.get("items_page", {})
+        last_notification_text = list_data.get("last_notification_text")
         item_list = list_data.get("items", [])
         completed = list_data.get("completed", False)
         owner_id = list_data.get("owner_id")
+        owner_username = view.get("owner_username") or f"ID владельца: {owner_id}"
 
-        owner_username = "<b>Неизвестный</b> владелец"
-        try:
-            owner_response = await self.http_client.get(f"{self.backend_url}/users/{owner_id}/", timeout=10)
-            owner_response.raise_for_status()
-            owner_data = owner_response.json()
-            owner_username = owner_data.get("username", "Неизвестный владелец") or f"ID владельца: {owner_id}"
-        except httpx.HTTPError as e:
-            logger.error(f"Ошибка получения имени владельца: {e}")
-
-        sorted_items_state = self.sort_states.get(list_id, False)
-        if sorted_items_state:
-            item_list = sorted(item_list, key=lambda x: x["name"].lower())
-        total_items = len(item_list)
-        items_per_page = 6
-        total_pages = (total_items + items_per_page - 1) // items_per_page if total_items > 0 else 0
-
-        current_page = max(1, min(current_page, total_pages)) if total_pages > 0 else 1
+        total_items = items_page.get("total", len(item_list))
+        total_pages = items_page.get("total_pages", 0)
+        current_page = items_page.get("page", 1)
 
         text_prefix = f"{' [Завершен]' if completed else ''}\nВладелец списка: @{owner_username}\n"
 
@@ -215,33 +348,17 @@ class BotUtils:
             f"{index + 1}. {'🟩' if item['bought'] else '⬜️'} {item['name'][:200]}{'' if len(item['name']) <= 200 else '...'}"
             for index, item in enumerate(item_list)]) + "</blockquote>")
 
-        all_bought = total_items > 0 and all(item["bought"] for item in item_list)
-        try:
-            response = await self.http_client.get(f"{self.backend_url}/utils/{user_id}/lists/{list_id}/skip_confirm/",
-                timeout=10)
-            response.raise_for_status()
-            skip_confirm = response.json().get("skip_confirm", False)
-        except httpx.HTTPError as e:
-            logger.error(f"Ошибка получения skip_confirm: {e}")
-            skip_confirm = False
+        all_bought = total_items > 0 and items_page.get("bought", 0) == total_items
+        skip_confirm = view.get("skip_confirm", False)
 
         text_suffix = "\n\n<b>Все элементы отмечены</b>. Завершить список?" if not completed and all_bought and not skip_confirm and owner_id == user_id else ""
-        keyboard = self.generate_confirm_keyboard(list_id) if text_suffix else self.generate_keyboard(list_id,
-                                                                                                      item_list,
-                                                                                                      completed,
-                                                                                                      owner_id, user_id,
-                                                                                                      current_page,
-                                                                                                      sorted_items=sorted_items_state)
+        page_items = item_list if completed else items_page.get("items", [])
+        keyboard = self.generate_confirm_keyboard(list_id) if text_suffix else self.generate_keyboard(
+            list_id, page_items, completed, owner_id, user_id, current_page, total_items, total_pages,
+            sorted_items=sorted_items_state)
         final_text = text_prefix + items_text + text_suffix
 
-        try:
-            response = await self.http_client.get(f"{self.backend_url}/utils/{user_id}/lists/{list_id}/last_message/",
-                                                  timeout=10)
-            response.raise_for_status()
-            last_message_ids = response.json().get("last_message_ids", [])
-        except httpx.HTTPError as e:
-            logger.error(f"Ошибка получения ID последнего сообщения: {e}")
-            last_message_ids = []
+        last_message_ids = view.get("last_message_ids", [])
 
         if last_message_ids:
             msg_id_to_edit = last_message_ids[0]
@@ -259,45 +376,40 @@ class BotUtils:
                     else:
                         logger.error(f"Не удалось удалить сообщение {msg_id_to_edit}: {e_del}")
                 try:
-                    await self.http_client.delete(
-                        f"{self.backend_url}/utils/{user_id}/lists/{list_id}/last_message/{msg_id_to_edit}/delete_one/",
-                        timeout=10)
+                    await self.backend.delete_one_last_message(user_id, list_id, msg_id_to_edit)
                     logger.info(
                         f"Устаревший last_message_id {msg_id_to_edit} очищен для user_id={user_id}, list_id={list_id}.")
                 except httpx.HTTPError as e_delete_one:
                     logger.error(f"Не удалось удалить last_message_id {msg_id_to_edit} из бэкенда: {e_delete_one}")
 
                 msg = await self.bot.send_message(chat_id, final_text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-                await self.http_client.post(f"{self.backend_url}/utils/{user_id}/lists/{list_id}/last_message/",
-                                            json={"message_id": msg.message_id}, timeout=10)
+                await self.backend.add_last_message(user_id, list_id, msg.message_id)
         else:
             msg = await self.bot.send_message(chat_id, final_text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-            await self.http_client.post(f"{self.backend_url}/utils/{user_id}/lists/{list_id}/last_message/",
-                                        json={"message_id": msg.message_id}, timeout=10)
+            await self.backend.add_last_message(user_id, list_id, msg.message_id)
 
         if notification_text:
             try:
-                await self.http_client.post(f"{self.backend_url}/lists/{list_id}/clear_notification/", timeout=10)
+                await self.backend.clear_list_notification(list_id)
             except httpx.HTTPError as e:
                 logger.error(f"Ошибка очистки уведомления на бэкенде: {e}")
 
-        try:
-            await self.http_client.post(f"{self.backend_url}/utils/{user_id}/lists/{list_id}/current_page/",
-                                        json={"page": current_page}, timeout=10)
-        except httpx.HTTPError as e:
-            logger.error(f"Ошибка сохранения текущей страницы: {e}")
+        if current_page != stored_page:
+            try:
+                await self.backend.set_current_page(user_id, list_id, current_page)
+            except httpx.HTTPError as e:
+                logger.error(f"Ошибка сохранения текущей страницы: {e}")
 
         logger.debug("END update_shopping_list_message: Завершено.")
 
     async def notify_list_change(self, list_id: str, exclude_user_id: int = None, action_type: str = None,
-                                 item_name: str = None):
-        try:
-            response = await self.http_client.get(f"{self.backend_url}/lists/{list_id}/", timeout=10)
-            response.raise_for_status()
-            list_data = response.json()
-        except httpx.HTTPError as e:
-            logger.error(f"Ошибка получения списка {list_id}: {e}")
-            return
+                                 item_name: str = None, list_data: dict = None):
+        if list_data is None:
+            try:
+                list_data = await self.backend.get_list(list_id)
+            except httpx.HTTPError as e:
+                logger.error(f"Ошибка получения списка {list_id}: {e}")
+                return
 
         if not list_data:
             return
@@ -309,9 +421,7 @@ class BotUtils:
         for user_id in list_data["users"]:
             logger.info(user_id)
             try:
-                response = await self.http_client.get(f"{self.backend_url}/users/{user_id}/", timeout=10)
-                response.raise_for_status()
-                user_data = response.json()
+                user_data = await self.get_user_profile(user_id)
                 logger.info(user_data)
                 chat_id = user_data.get("chat_id")
                 username = user_data.get("username")
@@ -319,10 +429,7 @@ class BotUtils:
                 if exclude_user_id == user_id:
                     username2_for_notification = username
                 else:
-                    response_user2 = await self.http_client.get(f"{self.backend_url}/users/{exclude_user_id}/",
-                                                                timeout=10)
-                    response_user2.raise_for_status()
-                    user_data2 = response_user2.json()
+                    user_data2 = await self.get_user_profile(exclude_user_id)
                     username2_for_notification = user_data2.get("username")
 
                 if exclude_user_id:
@@ -340,43 +447,17 @@ class BotUtils:
                         notification_text_to_store = f"@{username2_for_notification or 'Пользователь'} <b>отписался(лась)</b> от списка."
 
                 if action_type == "unsubscribe":
-                    try:
-                        response_owner_page = await self.http_client.get(
-                            f"{self.backend_url}/utils/{owner_id}/lists/{list_id}/current_page/", timeout=10)
-                        response_owner_page.raise_for_status()
-                        owner_current_page = response_owner_page.json().get("current_page", 1)
-                    except httpx.HTTPError as e:
-                        logger.error(f"Ошибка получения текущей страницы владельца {owner_id}: {e}")
-                        owner_current_page = 1
                     await self.update_shopping_list_message(chat_id=list_data['owner_id'], user_id=owner_id,
-                                                            list_id=list_id, current_page=owner_current_page,
-                                                            notification_text=notification_text_to_store)
+                                                            list_id=list_id, notification_text=notification_text_to_store)
                     if user_id != owner_id:
-                        try:
-                            response_page = await self.http_client.get(
-                                f"{self.backend_url}/utils/{user_id}/lists/{list_id}/current_page/", timeout=10)
-                            response_page.raise_for_status()
-                            current_page = response_page.json().get("current_page", 1)
-                        except httpx.HTTPError as e:
-                            logger.error(f"Ошибка получения текущей страницы пользователя {user_id}: {e}")
-                            current_page = 1
-                        await self.update_shopping_list_message(chat_id, user_id, list_id, current_page,
+                        await self.update_shopping_list_message(chat_id, user_id, list_id,
                                                                 notification_text=notification_text_to_store)
 
                 elif action_type != "unsubscribe":
                     if exclude_user_id != user_id:
-                        try:
-                            response_page = await self.http_client.get(
-                                f"{self.backend_url}/utils/{user_id}/lists/{list_id}/current_page/", timeout=10)
-                            response_page.raise_for_status()
-                            current_page = response_page.json().get("current_page", 1)
-                        except httpx.HTTPError as e:
-                            logger.error(f"Ошибка получения текущей страницы пользователя {user_id}: {e}")
-                            current_page = 1
-
                         notification_to_pass = notification_text_to_store if notification_text_to_store else None
-                        await self.update_shopping_list_message(chat_id, user_id, list_id, current_page,
-                                                                notification_to_pass)
+                        await self.update_shopping_list_message(chat_id, user_id, list_id,
+                                                                notification_text=notification_to_pass)
 
             except httpx.HTTPError as e:
                 logger.warning(f"Ошибка при обработке уведомления для пользователя {user_id}: {e}")
@@ -384,7 +465,6 @@ class BotUtils:
 
         if notification_text_to_store:
             try:
-                await self.http_client.post(f"{self.backend_url}/lists/{list_id}/notification/",
-                                            json={"notification_text": notification_text_to_store}, timeout=10)
+                await self.backend.set_list_notification(list_id, notification_text_to_store)
             except httpx.HTTPError as e:
                 logger.error(f"Ошибка сохранения уведомления на бэкенде: {e}")